@@ -2,7 +2,11 @@
 from __future__ import print_function
 
 import re, sys, os
-import pickle
+import shutil
+import fcntl
+import sqlite3
+import json
+import tempfile
 
 from io import StringIO
 
@@ -48,35 +52,139 @@ class RFC822Parser(dict):
 LSBLIB = '/var/lib/lsb'
 FACILITIES = os.path.join(LSBLIB, 'facilities')
 DEPENDS = os.path.join(LSBLIB, 'depends')
-LSBINSTALL = os.path.join(LSBLIB, 'lsbinstall')
+LSBINSTALL = os.path.join(LSBLIB, 'lsbinstall.db')
+HEADERS_DB = os.path.join(LSBLIB, 'headers.db')
+FACILITIES_DB = os.path.join(LSBLIB, 'facilities.db')
+DEPENDS_DB = os.path.join(LSBLIB, 'depends.db')
+LOCKFILE = os.path.join(LSBLIB, '.lock')
+
+# Replace path with data in one go: a crash leaves either the old or
+# the new contents, never a truncated file
+def write_atomically(path, data, mode=0o644):
+    dirname = os.path.dirname(path) or '.'
+    fd, tmpname = tempfile.mkstemp(prefix='.%s-' % os.path.basename(path),
+                                   dir=dirname)
+    try:
+        os.fchmod(fd, mode)
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(data)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.rename(tmpname, path)
+    except:
+        try:
+            os.unlink(tmpname)
+        except OSError:
+            pass
+        raise
+
+    # Make the rename itself durable
+    dirfd = os.open(dirname, os.O_RDONLY)
+    try:
+        os.fsync(dirfd)
+    finally:
+        os.close(dirfd)
+
+def unlink_quietly(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+# Serializes the programs updating the databases in LSBLIB: take it
+# before loading them, and keep it until they are saved (or the process
+# exits).  Also usable as a context manager.
+class DatabaseLock(object):
+    def __init__(self, lockfile=LOCKFILE):
+        self.lockfile = lockfile
+        self.fh = None
+
+    def acquire(self):
+        lockdir = os.path.dirname(self.lockfile)
+        if lockdir and not os.path.isdir(lockdir):
+            os.makedirs(lockdir, 0o755)
+        self.fh = open(self.lockfile, 'a')
+        fcntl.flock(self.fh.fileno(), fcntl.LOCK_EX)
+
+    def release(self):
+        # Closing the file releases the lock
+        self.fh.close()
+        self.fh = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
 
 beginre = re.compile(re.escape('### BEGIN INIT INFO'))
 endre = re.compile(re.escape('### END INIT INFO'))
 #linere = re.compile(r'\#\s+([^:]+):\s*(.*)')
+headerre = re.compile(r'([^:]+):\s*(.*)$')
+
+# The headers are near the top, so scripts are read in chunks of this
+# size only until the end of the header block
+SCAN_CHUNK = 65536
+
+BEGIN_MARKER = b'\n### BEGIN INIT INFO'
+END_MARKER = b'\n### END INIT INFO'
+
+def read_header_block(initfile):
+    # The lines of the header block; a newline is put in front of the
+    # file so that both markers have to start a line
+    data = bytearray(b'\n')
+    begin = end = -1
+    with open(initfile, 'rb') as fh:
+        while end < 0:
+            chunk = fh.read(SCAN_CHUNK)
+            if not chunk:
+                break
+            # A marker may straddle two chunks
+            start = max(len(data) - len(BEGIN_MARKER), 0)
+            data += chunk
+            if begin < 0:
+                begin = data.find(BEGIN_MARKER, start)
+                if begin < 0:
+                    del data[:-len(BEGIN_MARKER)]
+                    continue
+            end = data.find(END_MARKER, max(begin+1, start))
+    if begin < 0:
+        return []
+    if end < 0:
+        end = len(data)
+    return data[begin+1:end].decode('utf-8', 'replace').splitlines()[1:]
 
 def scan_initfile(initfile):
-    headerlines = ''
-    scanning = False
-    
-    for line in open(initfile):
+    rawheaders = {}
+    key = None
+    for line in read_header_block(initfile):
         line = line.rstrip()
-        if beginre.match(line):
-            scanning = True
+        if line.startswith('# '):
+            line = line[2:]
+        elif line.startswith('#\t'):
+            line = line[1:]
+        else:
             continue
-        elif scanning and endre.match(line):
-            scanning = False
+
+        if not line.strip():
             continue
-        elif not scanning:
+
+        # Continuation line
+        if line[0].isspace():
+            if key:
+                rawheaders[key] += '\n' + line.strip()
             continue
 
-        if line.startswith('# '):
-            headerlines += line[2:] + '\n'
-        elif line.startswith('#\t'):
-            headerlines += line[1:] + '\n'
+        m = headerre.match(line)
+        if not m:
+            # Not a valid header
+            continue
+        key, value = m.groups()
+        rawheaders[key] = value.strip()
 
-    inheaders = RFC822Parser(strob=headerlines)
     headers = {}
-    for header, body in inheaders.items():
+    for header, body in rawheaders.items():
         # Ignore empty headers
         if not body.strip():
             continue
@@ -91,84 +199,866 @@ def scan_initfile(initfile):
 
     return headers
 
-def save_facilities(facilities):
-    if not facilities:
+# Parsed headers of init scripts, kept in HEADERS_DB along with the
+# (mtime, size, inode) of each script, so only changed scripts are read
+# again.  The index is JSON, { "version" : 1, "scripts" : { initfile :
+# [mtime_ns, size, inode, headers] } }.  With no indexfile, the index is
+# only kept in memory.
+HEADERS_DB_VERSION = 1
+
+# HEADERS_DB only indexes the system's init scripts; other paths get an
+# index in memory, unless asked for one
+def default_index(path):
+    path = os.path.normpath(os.path.abspath(path))
+    if path == '/etc/init.d' or os.path.dirname(path) == '/etc/init.d':
+        return HEADERS_DB
+    return None
+
+class HeadersIndex(object):
+    def __init__(self, indexfile=HEADERS_DB):
+        self.indexfile = indexfile
+        self.entries = {}
+        self.changed = False
+        if indexfile is None:
+            return
         try:
-            os.unlink(FACILITIES)
-        except OSError:
+            with open(indexfile) as fh:
+                index = json.load(fh)
+            if index.get('version') == HEADERS_DB_VERSION:
+                self.entries = index['scripts']
+        except (IOError, OSError, ValueError, KeyError, AttributeError):
+            # Missing, unreadable or from another version; start afresh
             pass
+
+    def headers(self, initfile, st=None):
+        # Take the signature before reading, so that a script changing
+        # underneath us is read again next time
+        if st is None:
+            st = os.stat(initfile)
+        signature = [st.st_mtime_ns, st.st_size, st.st_ino]
+        entry = self.entries.get(initfile)
+        if entry and entry[:3] == signature:
+            return entry[3]
+        headers = scan_initfile(initfile)
+        self.entries[initfile] = signature + [headers]
+        self.changed = True
+        return headers
+
+    # The headers of every init script in initdir, { initfile : headers }
+    def scan(self, initdir='/etc/init.d'):
+        initdir = os.path.normpath(initdir)
+        found = {}
+        for entry in sorted(os.scandir(initdir), key=lambda e: e.name):
+            if ignoredre.search(entry.name) or not entry.is_file():
+                continue
+            try:
+                found[entry.path] = self.headers(entry.path, entry.stat())
+            except (IOError, OSError):
+                # Gone while scanning
+                continue
+
+        # Forget the scripts that are no longer there
+        for initfile in list(self.entries):
+            if os.path.dirname(initfile) == initdir and initfile not in found:
+                del self.entries[initfile]
+                self.changed = True
+        return found
+
+    def forget(self, initfile):
+        if self.entries.pop(initfile, None) is not None:
+            self.changed = True
+
+    def save(self):
+        if not self.changed or self.indexfile is None:
+            return
+        index = {'version' : HEADERS_DB_VERSION, 'scripts' : self.entries}
+        try:
+            write_atomically(self.indexfile,
+                             json.dumps(index, separators=(',', ':')).encode('utf-8'))
+            self.changed = False
+        except (IOError, OSError):
+            # Not writable by this user; just go without the index
+            pass
+
+def load_all_headers(initdir='/etc/init.d', indexfile=None):
+    if indexfile is None:
+        indexfile = default_index(initdir)
+    index = HeadersIndex(indexfile)
+    headers = index.scan(initdir)
+    index.save()
+    return headers
+
+# The facilities and depends databases are versioned JSON, indexed by
+# facility and by init script.  The text files older versions wrote
+# (FACILITIES, DEPENDS) are still written alongside, so that older
+# versions find the same data after a downgrade, and are read instead
+# whenever the database is missing or older than them: an older version
+# only updates (or, when empty, removes) the text files.
+DB_VERSION = 1
+
+def load_db(dbfile, textfile=None):
+    if textfile is not None:
+        try:
+            if os.stat(textfile).st_mtime_ns > os.stat(dbfile).st_mtime_ns:
+                return None
+        except OSError:
+            # The text file is gone, or there is no database
+            return None
+    try:
+        with open(dbfile) as fh:
+            db = json.load(fh)
+    except (IOError, OSError):
+        return None
+    except ValueError:
+        print('Invalid database', dbfile, '(ignored)', file=sys.stderr)
+        return None
+    if not isinstance(db, dict) or db.get('version') != DB_VERSION:
+        print('Unknown database version in', dbfile, '(ignored)', file=sys.stderr)
+        return None
+    return db
+
+# Saves db, { key : value }, along with text, its text format, or
+# removes both if db[key] has no entries
+def save_db(dbfile, key, db, textfile, text):
+    if not db[key]:
+        unlink_quietly(dbfile)
+        unlink_quietly(textfile)
         return
-    
-    fh = open(FACILITIES, 'w')
-    for facility, entries in facilities.items():
+    db = dict(db, version=DB_VERSION)
+    data = json.dumps(db, separators=(',', ':'), sort_keys=True)
+    write_atomically(textfile, text.encode('utf-8'))
+    write_atomically(dbfile, data.encode('utf-8'))
+
+def save_facilities(facilities, dbfile=FACILITIES_DB, textfile=FACILITIES):
+    entries = {}
+    for facility, scripts in facilities.items():
         # Ignore system facilities
         if facility.startswith('$'): continue
-        for (scriptname, pri) in entries.items():
-            start, stop = pri
-            print("%(scriptname)s %(facility)s %(start)d %(stop)d" % locals(), file=fh)
-    fh.close()
+        if scripts:
+            entries[facility] = dict((scriptname, list(pri))
+                                     for scriptname, pri in scripts.items())
+    text = ''.join('%s %s %d %d\n' % (scriptname, facility, pri[0], pri[1])
+                   for facility, scripts in sorted(entries.items())
+                   for scriptname, pri in sorted(scripts.items()))
+    save_db(dbfile, 'facilities', {'facilities' : entries}, textfile, text)
 
-def load_facilities():
+def load_facilities(dbfile=FACILITIES_DB, textfile=FACILITIES):
     facilities = {}
-    if os.path.exists(FACILITIES):
-        for line in open(FACILITIES):
-            try:
-                scriptname, name, start, stop = line.strip().split()
-                facilities.setdefault(name, {})[scriptname] = (int(start),
-                                                               int(stop))
-            except ValueError as x:
-                print('Invalid facility line', line, file=sys.stderr)
+    db = load_db(dbfile, textfile)
+    if db is not None:
+        for name, scripts in db.get('facilities', {}).items():
+            facilities[name] = dict((scriptname, tuple(pri))
+                                    for scriptname, pri in scripts.items())
+        return facilities
+
+    if os.path.exists(textfile):
+        with open(textfile) as fh:
+            for line in fh:
+                try:
+                    scriptname, name, start, stop = line.strip().split()
+                    facilities.setdefault(name, {})[scriptname] = (int(start),
+                                                                   int(stop))
+                except ValueError as x:
+                    print('Invalid facility line', line, file=sys.stderr)
 
     return facilities
 
-def load_depends():
+# The scripts needing each facility, { facility : [initfile, ...] }
+def build_dependents(depends):
+    dependents = {}
+    for initfile, facilities in depends.items():
+        for facility in facilities:
+            dependents.setdefault(facility, []).append(initfile)
+    for scripts in dependents.values():
+        scripts.sort()
+    return dependents
+
+# The depends database, along with its reverse index by facility, which
+# is saved with it
+def load_depends_index(dbfile=DEPENDS_DB, textfile=DEPENDS):
+    db = load_db(dbfile, textfile)
+    if db is not None:
+        depends = db.get('depends', {})
+        dependents = db.get('dependents')
+        if dependents is None:
+            dependents = build_dependents(depends)
+        return depends, dependents
+
     depends = {}
+    if os.path.exists(textfile):
+        with open(textfile) as fh:
+            for line in fh:
+                if ':' not in line:
+                    continue
+                initfile, facilities = line.split(':', 1)
+                depends[initfile.strip()] = facilities.split()
+    return depends, build_dependents(depends)
+
+def load_depends(dbfile=DEPENDS_DB, textfile=DEPENDS):
+    return load_depends_index(dbfile, textfile)[0]
+
+def load_dependents(dbfile=DEPENDS_DB, textfile=DEPENDS):
+    return load_depends_index(dbfile, textfile)[1]
+
+def save_depends(depends, dbfile=DEPENDS_DB, textfile=DEPENDS):
+    depends = dict((initfile, list(facilities))
+                   for initfile, facilities in depends.items() if facilities)
+    text = ''.join('%s: %s\n' % (initfile, ' '.join(facilities))
+                   for initfile, facilities in sorted(depends.items()))
+    save_db(dbfile, 'depends', {'depends' : depends,
+                                'dependents' : build_dependents(depends)},
+            textfile, text)
+
+# Estimated priorities of these facilities in Debian
+OS_FACILITIES = {
+    "$local_fs" : {'lsb' : (0, 100)},
+    "$network" : {'lsb' : (10, 50)},
+    "$remote_fs" : {'lsb': (19, 20)},
+    "$named" : {'lsb': (19, 19)},
+    "$syslog" : {'lsb' : (10, 89)},
+    # No longer present in gLSB 1.2; however, required for gLSB 1.1
+    # compat.  Note that these are looser than $portmap and $time;
+    # anything specifying $netdaemons will be run later, which may not
+    # be what you want...
+    "$netdaemons" : {'lsb': (80, 19)},
+    # gLSB 1.2
+    "$portmap" : {'lsb' : (19, 34)},
+    "$time" : {'lsb' : (24, 21)},
+    }
+
+# Default priorities
+DEFAULT_PRIORITY = 20
+
+# Files in an init.d directory that are not init scripts
+ignoredre = re.compile(r'^(\.|README$|skeleton$|rc$|rcS$)|(~|\.swp|\.dpkg-[a-z]+|\.ucf-[a-z]+|\.rpm[a-z]*)$')
+
+def list_initscripts(initdir='/etc/init.d'):
+    scripts = []
+    for name in sorted(os.listdir(initdir)):
+        path = os.path.join(initdir, name)
+        if not ignoredre.search(name) and os.path.isfile(path):
+            scripts.append(path)
+    return scripts
+
+# The dependency graph of a set of init scripts, { initfile : headers }.
+# For each of the start and stop sequences there is an edge from a script
+# to every script using a facility it provides.  Priorities are assigned
+# along a topological order (Kahn's algorithm), each script getting the
+# longest path to it: it starts after, and stops before, everything it
+# depends on, whatever the order the scripts were added in.  Adding or
+# removing scripts only re-ranks the scripts that depend on them.
+class DependencyGraph(object):
+    # Headers and initial priority of each sequence
+    sequences = {
+        'start' : ('Required-Start', 'Should-Start', 5),
+        'stop' : ('Required-Stop', 'Should-Stop', 95),
+        }
+
+    def __init__(self, facilities=None):
+        # Facilities provided outside of the graph, including the system
+        # facilities, as loaded by load_facilities()
+        if facilities is None:
+            facilities = OS_FACILITIES
+        self.external = facilities
+        self.headers = {}
+        self.providers = {}
+        self.users = {'start' : {}, 'stop' : {}}
+        self.ranks = {'start' : {}, 'stop' : {}}
+        self.needs = {'start' : {}, 'stop' : {}}
+
+    def wants(self, initfile, seq):
+        required, should, first = self.sequences[seq]
+        headers = self.headers[initfile]
+        return headers.get(required, []) + headers.get(should, [])
+
+    def predecessors(self, initfile, seq):
+        scripts = set()
+        for facility in self.wants(initfile, seq):
+            scripts.update(self.providers.get(facility, ()))
+        scripts.discard(initfile)
+        return scripts
+
+    def successors(self, initfile, seq):
+        scripts = set()
+        for facility in self.headers[initfile].get('Provides', []):
+            scripts.update(self.users[seq].get(facility, ()))
+        scripts.discard(initfile)
+        return scripts
+
+    def descendants(self, initfiles, seq):
+        seen = set(initfiles)
+        todo = list(seen)
+        while todo:
+            for script in self.successors(todo.pop(), seq):
+                if script not in seen:
+                    seen.add(script)
+                    todo.append(script)
+        return seen
+
+    def priority(self, initfile):
+        return (self.ranks['start'][initfile], self.ranks['stop'][initfile])
+
+    @property
+    def priorities(self):
+        return dict((initfile, self.priority(initfile))
+                    for initfile in self.headers)
+
+    # The required facilities of initfile, as saved by save_depends()
+    def needed(self, initfile):
+        needed = list(self.needs['start'][initfile])
+        for facility in self.needs['stop'][initfile]:
+            if facility not in needed:
+                needed.append(facility)
+        return needed
+
+    def _register(self, initfile, headers):
+        self.headers[initfile] = headers
+        for facility in headers.get('Provides', []):
+            self.providers.setdefault(facility, set()).add(initfile)
+        for seq in self.sequences:
+            for facility in self.wants(initfile, seq):
+                self.users[seq].setdefault(facility, set()).add(initfile)
+
+    def _unregister(self, initfile):
+        for seq in self.sequences:
+            for facility in self.wants(initfile, seq):
+                users = self.users[seq][facility]
+                users.discard(initfile)
+                if not users:
+                    del self.users[seq][facility]
+            self.ranks[seq].pop(initfile, None)
+            self.needs[seq].pop(initfile, None)
+        for facility in self.headers[initfile].get('Provides', []):
+            providers = self.providers[facility]
+            providers.discard(initfile)
+            if not providers:
+                del self.providers[facility]
+        del self.headers[initfile]
+
+    # Kahn's algorithm over nodes; a loop is an error if it involves one
+    # of the strict scripts, and is otherwise broken at its first script
+    def _order(self, nodes, seq, strict):
+        indegree = dict.fromkeys(nodes, 0)
+        for initfile in nodes:
+            for script in self.successors(initfile, seq):
+                if script in indegree:
+                    indegree[script] += 1
+        ready = sorted(initfile for initfile in nodes if not indegree[initfile])
+        order = []
+        while len(order) < len(nodes):
+            if not ready:
+                loop = sorted(initfile for initfile in nodes
+                              if indegree[initfile] > 0)
+                if strict.intersection(loop):
+                    raise ValueError('Dependency loop between ' + ' '.join(loop))
+                indegree[loop[0]] = 0
+                ready = [loop[0]]
+            initfile = ready.pop(0)
+            order.append(initfile)
+            for script in sorted(self.successors(initfile, seq)):
+                if script in indegree:
+                    indegree[script] -= 1
+                    if not indegree[script]:
+                        ready.append(script)
+        return order
 
-    if os.path.exists(DEPENDS):
-        independs = RFC822Parser(fileob=open(DEPENDS))
-        for initfile, facilities in independs.items():
-            depends[initfile] = facilities.split()
-    return depends
+    def _rank(self, initfile, seq, ranks, strict):
+        required, should, pri = self.sequences[seq]
+        wanted = self.wants(initfile, seq)
+        if not wanted:
+            return DEFAULT_PRIORITY, []
 
-def save_depends(depends):
-    if not depends:
+        index = (seq == 'stop') and 1 or 0
+        needed = []
+        for facility in wanted:
+            pris = []
+            scripts = self.providers.get(facility, set()) - set([initfile])
+            for script in scripts:
+                if script in ranks:
+                    pris.append(ranks[script])
+                elif script in self.ranks[seq]:
+                    pris.append(self.ranks[seq][script])
+            # Providers only known from the facilities database count too
+            for script, pair in self.external.get(facility, {}).items():
+                if script != initfile and script not in self.headers:
+                    pris.append(pair[index])
+            if not scripts and not pris:
+                if initfile not in strict:
+                    continue
+                if facility in self.headers[initfile].get(required, []):
+                    raise ValueError('Missing required %s facility %s' % (seq, facility))
+                print('Missing should-%s facility' % seq, facility, '(ignored)', file=sys.stderr)
+                continue
+            for p in pris:
+                if seq == 'start':
+                    pri = max(pri, p+1)
+                else:
+                    pri = min(pri, p-1)
+            if (facility in self.headers[initfile].get(required, []) and
+                facility not in needed):
+                needed.append(facility)
+        return min(max(pri, 1), 99), needed
+
+    # Re-rank roots and everything depending on them; nothing is changed
+    # unless both sequences could be ranked.  Returns the scripts whose
+    # priorities changed.
+    def _update(self, roots, strict):
+        results = {}
+        for seq in self.sequences:
+            ranks, needs = {}, {}
+            nodes = self.descendants(roots, seq)
+            for initfile in self._order(nodes, seq, strict):
+                ranks[initfile], needs[initfile] = self._rank(initfile, seq,
+                                                              ranks, strict)
+            results[seq] = (ranks, needs)
+
+        changed = set()
+        for seq, (ranks, needs) in results.items():
+            for initfile, pri in ranks.items():
+                if self.ranks[seq].get(initfile) != pri:
+                    changed.add(initfile)
+            self.ranks[seq].update(ranks)
+            self.needs[seq].update(needs)
+        return changed
+
+    # Add scripts, { initfile : headers }, replacing those already there.
+    # With strict, a missing required facility or a dependency loop
+    # involving one of them raises ValueError and leaves them out.
+    def add(self, scripts, strict=True):
+        self.remove([initfile for initfile in scripts
+                     if initfile in self.headers])
+        for initfile, headers in scripts.items():
+            self._register(initfile, headers)
         try:
-            os.unlink(DEPENDS)
-        except OSError:
-            pass
-        return
-    
-    fh = open(DEPENDS, 'w')
-    for initfile, facilities in depends.items():
-        print('%s: %s' % (initfile, ' '.join(facilities)), file=fh)
-    fh.close()
+            return self._update(set(scripts), strict and set(scripts) or set())
+        except ValueError:
+            for initfile in scripts:
+                self._unregister(initfile)
+            raise
 
-# filemap entries are mappings, { (package, filename) : instloc }
-def load_lsbinstall_info():
-    if not os.path.exists(LSBINSTALL):
-        return {}
-    
-    fh = open(LSBINSTALL, 'rb')
-    filemap = cPickle.load(fh)
-    fh.close()
+    def remove(self, initfiles):
+        roots = set()
+        for initfile in initfiles:
+            for seq in self.sequences:
+                roots.update(self.successors(initfile, seq))
+        for initfile in initfiles:
+            self._unregister(initfile)
+        return self._update(roots.difference(initfiles), set())
 
-    # Just in case it's corrupted somehow
-    if not isinstance(filemap, dict):
-        return {}
+    # The scripts initfile has to wait for when running the sequence;
+    # the stop sequence runs the graph backwards
+    def waits_for(self, initfile, seq='start'):
+        if seq == 'stop':
+            return self.successors(initfile, seq)
+        return self.predecessors(initfile, seq)
+
+    def _run_order(self, seq):
+        order = self._order(set(self.headers), seq, set())
+        if seq == 'stop':
+            order.reverse()
+        return order
+
+    # Sets of scripts that can run concurrently, in order: every script
+    # only waits for scripts of the earlier levels
+    def levels(self, seq='start'):
+        level = {}
+        levels = []
+        for initfile in self._run_order(seq):
+            n = 0
+            for script in self.waits_for(initfile, seq):
+                if script in level:
+                    n = max(n, level[script]+1)
+            level[initfile] = n
+            if n == len(levels):
+                levels.append([])
+            levels[n].append(initfile)
+        return [sorted(scripts) for scripts in levels]
+
+    # Simulate running the sequence with every script starting as soon
+    # as those it depends on are done, given { initfile : seconds };
+    # returns the length of the critical path and the scripts along it.
+    def critical_path(self, timings, seq='start'):
+        finish = {}
+        previous = {}
+        for initfile in self._run_order(seq):
+            begin = 0.0
+            previous[initfile] = None
+            for script in sorted(self.waits_for(initfile, seq)):
+                if finish.get(script, -1) > begin:
+                    begin = finish[script]
+                    previous[initfile] = script
+            finish[initfile] = begin + timings.get(initfile, 0.0)
+
+        if not finish:
+            return 0.0, []
+        initfile = max(sorted(finish), key=finish.get)
+        length = finish[initfile]
+        path = []
+        while initfile:
+            path.insert(0, initfile)
+            initfile = previous[initfile]
+        return length, path
+
+# Register scripts, { initfile: headers }, in facilities and depends (as
+# loaded, with OS_FACILITIES added to facilities), ranking them in graph,
+# by default one holding just them.  Scripts registered earlier whose
+# priorities change with the new ones are registered again.  Returns
+# { initfile: (startpri, stoppri) } for both.
+def assign_priorities(scripts, facilities, depends, graph=None):
+    if graph is None:
+        graph = DependencyGraph(facilities)
+    changed = graph.add(scripts)
+
+    registered = set(depends)
+    for facility, providers in facilities.items():
+        if not facility.startswith('$'):
+            registered.update(providers)
+    updated = dict(scripts)
+    for initfile in changed:
+        if initfile not in scripts and initfile in registered:
+            updated[initfile] = graph.headers[initfile]
+
+    priorities = {}
+    for initfile in sorted(updated):
+        priorities[initfile] = graph.priority(initfile)
+        needed = graph.needed(initfile)
+        if needed:
+            depends[initfile] = needed
+        else:
+            depends.pop(initfile, None)
+        for facility in updated[initfile].get('Provides', []):
+            if facility[0] == '$':
+                if initfile in scripts:
+                    print('Ignoring system-provided facility', facility, file=sys.stderr)
+                continue
+            facilities.setdefault(facility, {})[initfile] = priorities[initfile]
+
+    return priorities
+
+# Per-script timings, "script seconds" lines, keyed by script name
+def load_timings(timingfile):
+    timings = {}
+    with open(timingfile) as fh:
+        for line in fh:
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            try:
+                script, seconds = line.split()
+                timings[script] = float(seconds)
+            except ValueError:
+                print('Invalid timing line', line, file=sys.stderr)
+    return timings
+
+LEVEL_FORMATS = ('make', 'json')
+
+# Export the levels of a sequence for a parallel starter, either in the
+# makefile style of insserv's .depend.start (every target followed by
+# the targets it has to wait for) or as JSON; scripts are named by
+# their basename.
+def format_levels(graph, fmt='make', seq='start'):
+    name = os.path.basename
+    levels = graph.levels(seq)
+    if fmt == 'json':
+        depends = {}
+        for scripts in levels:
+            for initfile in scripts:
+                depends[name(initfile)] = sorted(
+                    name(script) for script in graph.waits_for(initfile, seq))
+        return json.dumps({'sequence' : seq,
+                           'levels' : [[name(initfile) for initfile in scripts]
+                                       for scripts in levels],
+                           'depends' : depends}, indent=2, sort_keys=True)
+    elif fmt != 'make':
+        raise ValueError('Unknown format ' + fmt)
+
+    targets = [name(initfile) for scripts in levels for initfile in scripts]
+    lines = ['TARGETS = ' + ' '.join(targets)]
+    for scripts in levels:
+        for initfile in scripts:
+            wait = sorted(name(script)
+                          for script in graph.waits_for(initfile, seq))
+            if wait:
+                lines.append('%s: %s' % (name(initfile), ' '.join(wait)))
+    return '\n'.join(lines)
+
+# The files installed by lsbinstall, { (package, filename) : instloc },
+# in an SQLite database: entries are looked up, added and removed one by
+# one, and every change is committed atomically.  Use as
+#   with LsbInstallDB() as db:
+#       changes
+# to commit them all at once (or none, on an exception).
+class LsbInstallDB(object):
+    def __init__(self, dbfile=LSBINSTALL):
+        self.db = sqlite3.connect(dbfile)
+        self.depth = 0
+        self.db.execute('CREATE TABLE IF NOT EXISTS files ('
+                        'package TEXT NOT NULL, filename TEXT NOT NULL, '
+                        'instloc TEXT NOT NULL, '
+                        'PRIMARY KEY (package, filename))')
+        self.db.commit()
+
+    def get(self, package, filename, default=None):
+        row = self.db.execute('SELECT instloc FROM files WHERE '
+                              'package = ? AND filename = ?',
+                              (package, filename)).fetchone()
+        if row is None:
+            return default
+        return row[0]
+
+    def items(self):
+        return [((package, filename), instloc) for package, filename, instloc
+                in self.db.execute('SELECT package, filename, instloc FROM files')]
+
+    def _changed(self):
+        # Outside of a with block, every change is committed right away
+        if not self.depth:
+            self.db.commit()
+
+    def add(self, package, filename, instloc):
+        self.db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?)',
+                        (package, filename, instloc))
+        self._changed()
+
+    def remove(self, package, filename):
+        self.db.execute('DELETE FROM files WHERE package = ? AND filename = ?',
+                        (package, filename))
+        self._changed()
+
+    def replace(self, filemap):
+        self.db.execute('DELETE FROM files')
+        self.db.executemany('INSERT INTO files VALUES (?, ?, ?)',
+                            [(package, filename, instloc) for
+                             (package, filename), instloc in filemap.items()])
+        self._changed()
 
-    return filemap
+    def close(self):
+        self.db.close()
 
-def save_lsbinstall_info(filemap):
+    def __enter__(self):
+        self.depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.depth -= 1
+        if self.depth:
+            return
+        if exc_type is None:
+            self.db.commit()
+        else:
+            self.db.rollback()
+
+def load_lsbinstall_info(dbfile=LSBINSTALL):
+    if not os.path.exists(dbfile):
+        return {}
+    db = LsbInstallDB(dbfile)
+    try:
+        return dict(db.items())
+    finally:
+        db.close()
+
+def save_lsbinstall_info(filemap, dbfile=LSBINSTALL):
     if not filemap:
-        try:
-            os.unlink(LSBINSTALL)
-        except OSError:
-            pass
+        unlink_quietly(dbfile)
         return
-    
-    fh = open(LSBINSTALL, 'wb')
-    cPickle.dump(fh, filemap)
-    fh.close()
+    db = LsbInstallDB(dbfile)
+    try:
+        db.replace(filemap)
+    finally:
+        db.close()
+
+HEADER_FORMATS = ('shell', 'json', 'value')
+
+def shell_quote(value):
+    return "'" + value.replace("'", "'\\''") + "'"
+
+def header_text(value):
+    if isinstance(value, list):
+        return ' '.join(str(item) for item in value)
+    return value
+
+# Variable names for the shell format: LSB_ and the header, upper-cased,
+# with anything but letters and digits made an underscore; prefix is
+# put before the header name, to tell scripts apart
+def header_variable(header, prefix=''):
+    return re.sub(r'[^A-Za-z0-9]', '_', 'LSB_' + prefix + header).upper()
+
+# headers is { initfile : headers }; keys, if given, selects the headers
+# to output, in that order.  The shell format gives assignments to eval
+# (named after the script as well when there are several), json an
+# object by script, and value the bare values, one per line, like
+# get_lsb_header_val in init-functions.
+def format_headers(headers, fmt='shell', keys=None):
+    selected = {}
+    for initfile, fields in headers.items():
+        if keys:
+            fields = dict((key, fields[key]) for key in keys if key in fields)
+        selected[initfile] = fields
+
+    if fmt == 'json':
+        return json.dumps(selected, indent=2, sort_keys=True)
+    elif fmt not in HEADER_FORMATS:
+        raise ValueError('Unknown format ' + fmt)
+
+    lines = []
+    for initfile in sorted(selected):
+        fields = selected[initfile]
+        order = keys or sorted(fields)
+        prefix = ''
+        if len(selected) > 1:
+            prefix = os.path.basename(initfile) + '_'
+        for key in order:
+            if key not in fields:
+                continue
+            value = header_text(fields[key])
+            if fmt == 'value':
+                lines.append(value)
+            else:
+                lines.append('%s=%s' % (header_variable(key, prefix),
+                                        shell_quote(value)))
+    return '\n'.join(lines)
+
+SERVICES = '/etc/services'
+
+class ServiceEntry(object):
+    def __init__(self, name, port, proto, aliases=None, comment=''):
+        self.name = name
+        self.port = port
+        self.proto = proto
+        self.aliases = aliases or []
+        self.comment = comment
+        # The line it was read from, if any
+        self.text = None
+
+    def names(self):
+        return [self.name] + self.aliases
+
+    def format(self):
+        endbits = ''
+        if self.aliases:
+            endbits = ' '.join(self.aliases) + ' '
+        if self.comment:
+            endbits += '#' + self.comment
+        line = '%15s %15s %s' % (self.name, '%d/%s' % (self.port, self.proto),
+                                 endbits)
+        return line.rstrip()
+
+# /etc/services read once, and indexed by (port, proto) and by (name or
+# alias, proto).  Any number of entries can be added, checked and
+# removed; save() then writes the file back in one go, keeping every
+# line that was not changed (comments included) as it was.
+class ServicesFile(object):
+    def __init__(self, path=SERVICES):
+        self.path = path
+        # Lines are either kept text or ServiceEntry objects
+        self.lines = []
+        self.by_port = {}
+        self.by_name = {}
+        self.changed = set()
+        self.removed = set()
+
+        with open(path) as fh:
+            for line in fh:
+                line = line.rstrip('\n')
+                entry = self.parse_line(line)
+                if entry is None or (entry.port, entry.proto) in self.by_port:
+                    self.lines.append(line)
+                    continue
+                self.lines.append(entry)
+                self._index(entry)
+
+    @staticmethod
+    def parse_line(line):
+        body, sep, comment = line.partition('#')
+        bits = body.split()
+        if len(bits) < 2 or '/' not in bits[1]:
+            return None
+        port, proto = bits[1].split('/', 1)
+        try:
+            port = int(port)
+        except ValueError:
+            return None
+        entry = ServiceEntry(bits[0], port, proto, bits[2:], comment)
+        entry.text = line
+        return entry
+
+    def _index(self, entry):
+        self.by_port[(entry.port, entry.proto)] = entry
+        for name in entry.names():
+            self.by_name.setdefault((name, entry.proto), entry)
+
+    def lookup(self, port, proto):
+        return self.by_port.get((port, proto))
+
+    def lookup_name(self, name, proto):
+        return self.by_name.get((name, proto))
+
+    # Register name and aliases for port/proto: they are added to the
+    # aliases of an existing entry, or make up a new one.  ValueError if
+    # one of them already stands for another port.
+    def add(self, port, proto, name, aliases=(), package=None):
+        for alias in [name] + list(aliases):
+            other = self.lookup_name(alias, proto)
+            if other is not None and other.port != port:
+                raise ValueError('Conflict between %s %d/%s and %s %d/%s in %s' % (
+                    alias, port, proto, other.name, other.port, other.proto,
+                    self.path))
+
+        entry = self.lookup(port, proto)
+        if entry is None:
+            entry = ServiceEntry(name, port, proto, list(aliases),
+                                 ' Added by lsbinstall for %s' % (
+                                     package or '<unknown package>'))
+            self.lines.append(entry)
+            self._index(entry)
+            self.changed.add(entry)
+            return entry
+
+        for alias in [name] + list(aliases):
+            if alias not in entry.names():
+                entry.aliases.append(alias)
+                self.by_name.setdefault((alias, proto), entry)
+                self.changed.add(entry)
+        return entry
+
+    # Only entries lsbinstall added are removed; LSB does not require
+    # removing anything else.  Returns whether the entry was removed.
+    def remove(self, port, proto, package=None):
+        entry = self.lookup(port, proto)
+        if entry is None:
+            return False
+        marker = ' Added by lsbinstall for '
+        if not entry.comment.startswith(marker):
+            return False
+        if package and entry.comment[len(marker):].strip() != package:
+            return False
+        del self.by_port[(port, proto)]
+        for name in entry.names():
+            if self.by_name.get((name, proto)) is entry:
+                del self.by_name[(name, proto)]
+        self.removed.add(entry)
+        return True
+
+    def save(self):
+        if not (self.changed or self.removed):
+            return
+        lines = []
+        for line in self.lines:
+            if line in self.removed:
+                continue
+            if isinstance(line, ServiceEntry):
+                if line in self.changed or line.text is None:
+                    line = line.format()
+                else:
+                    line = line.text
+            lines.append(line + '\n')
+        self.lines = [line for line in self.lines if line not in self.removed]
+        # Keep the previous version around, as it always was
+        shutil.copy2(self.path, self.path + '~')
+        write_atomically(self.path, ''.join(lines).encode('utf-8'),
+                         os.stat(self.path).st_mode & 0o7777)
+        self.changed = set()
+        self.removed = set()
 
 if __name__ == '__main__':
     print(scan_initfile('init-fragment'))
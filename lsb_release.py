@@ -27,6 +27,159 @@ import os
 import re
 import warnings
 import csv
+import json
+import tempfile
+import io
+import fnmatch
+import time
+import functools
+
+DISTRO_INFO_DIR = '/usr/share/distro-info'
+APT_LISTS_DIR = '/var/lib/apt/lists'
+APT_PREFERENCES = '/etc/apt/preferences'
+APT_CONF = '/etc/apt/apt.conf'
+
+# Opt-in timing of the detection stages.  When enabled, either with
+# enable_timing() or by setting LSB_DEBUG_TIMING (to 1 or - for standard
+# error, or to a file name), every stage records its wall time, the
+# files it opened and the programs it ran (with audit hooks, python 3.8
+# and later) and the bytes read (from /proc/self/io).  The records are
+# written out as JSON lines as stages end, and kept for get_timings().
+# LSB_DEBUG_TIMING is only looked at when the first stage runs, so that
+# importing the module does no I/O.
+class StageTimer(object):
+    def __init__(self):
+        self.enabled = False
+        self.environ_checked = False
+        self.output = None
+        # A file name given in LSB_DEBUG_TIMING, appended to and closed
+        # again for each record
+        self.path = None
+        self.records = []
+        self.stack = []
+        self.counts = {'opens' : 0, 'execs' : 0}
+        self.overhead = 0
+        self.hooked = False
+
+    def enable(self, output=None, path=None):
+        self.enabled = True
+        self.environ_checked = True
+        self.output = output
+        self.path = path
+        # Audit hooks cannot be removed; once timing is disabled, this
+        # one returns straight away
+        if not self.hooked and hasattr(sys, 'addaudithook'):
+            sys.addaudithook(self.audit)
+            self.hooked = True
+
+    def disable(self):
+        self.enabled = False
+        self.environ_checked = True
+        self.output = None
+        self.path = None
+
+    def enable_from_environ(self):
+        self.environ_checked = True
+        target = os.environ.get('LSB_DEBUG_TIMING')
+        if not target:
+            return False
+        if target in ('1', '-'):
+            self.enable(sys.stderr)
+        else:
+            self.enable(path=target)
+        return True
+
+    def audit(self, event, args):
+        if not self.enabled:
+            return
+        if event == 'open' and args[0] != '/proc/self/io':
+            self.counts['opens'] += 1
+        elif event == 'subprocess.Popen':
+            self.counts['execs'] += 1
+
+    def read_bytes(self):
+        try:
+            with open('/proc/self/io') as fh:
+                data = fh.read()
+        except (IOError, OSError):
+            return None
+        # Reading /proc/self/io is not what is being measured
+        self.overhead += len(data)
+        for line in data.splitlines():
+            if line.startswith('rchar:'):
+                return int(line.split()[1])
+        return None
+
+    def snapshot(self):
+        overhead = self.overhead
+        return time.time(), dict(self.counts), self.read_bytes(), overhead
+
+    def write(self, line):
+        if self.path is not None:
+            try:
+                with open(self.path, 'a') as fh:
+                    fh.write(line)
+                return
+            except (IOError, OSError) as msg:
+                print('Unable to open ' + self.path + ':', str(msg),
+                      file=sys.stderr)
+                self.path = None
+                self.output = sys.stderr
+        if self.output is not None:
+            self.output.write(line)
+            self.output.flush()
+
+    def record(self, stage, start):
+        now = time.time()
+        counts = dict(self.counts)
+        overhead = self.overhead
+        read = self.read_bytes()
+        then, startcounts, startread, startoverhead = start
+        entry = {'stage' : stage, 'start' : then,
+                 'seconds' : round(now - then, 6),
+                 'parent' : self.stack and self.stack[-1] or None}
+        if self.hooked:
+            for key in counts:
+                entry[key] = counts[key] - startcounts[key]
+        if read is not None and startread is not None:
+            entry['read_bytes'] = read - startread - (overhead - startoverhead)
+        self.records.append(entry)
+        self.write(json.dumps(entry, sort_keys=True) + '\n')
+
+    def timed(self, stage):
+        def decorate(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled and (self.environ_checked or
+                                         not self.enable_from_environ()):
+                    return func(*args, **kwargs)
+                start = self.snapshot()
+                self.stack.append(stage)
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.stack.pop()
+                    self.record(stage, start)
+            return wrapper
+        return decorate
+
+stage_timer = StageTimer()
+timed = stage_timer.timed
+
+def enable_timing(output=None):
+    stage_timer.enable(output)
+
+def disable_timing():
+    stage_timer.disable()
+
+def get_timings():
+    return list(stage_timer.records)
+
+def reset_timings():
+    del stage_timer.records[:]
+
+def enable_timing_from_environ():
+    return stage_timer.enable_from_environ()
 
 def get_rolling_suites(origin):
     suites = ['testing', 'unstable', 'experimental']
@@ -36,56 +189,13 @@ def get_rolling_suites(origin):
     prefix = prefixes.get(origin.lower(), '')
     return [prefix + s for s in suites]
 
-def get_distro_info(origin='Debian'):
-    try:
-        FileNotFoundException = FileNotFoundError
-    except NameError:
-        # There is no FileNotFoundError in python2
-        FileNotFoundException = IOError
+def get_distro_info_path(origin):
+    return os.path.join(DISTRO_INFO_DIR, '%s.csv' % origin.lower())
 
-    try:
-        csvfile = open('/usr/share/distro-info/%s.csv' % origin.lower())
-    except FileNotFoundException:
-        # Unknown distro, fallback to Debian
-        csvfile = open('/usr/share/distro-info/debian.csv')
-        origin = 'Debian'
-
-    reader = csv.DictReader(csvfile)
-    version_to_codename = {}
-    noversion_codenames = []
-    testing_candidates = []
-    for row in reader:
-        version, codename, release = [row[x] for x in ('version', 'series',
-                                                       'release')]
-        if version:
-            version_to_codename[version] = codename
-            if not release:
-                testing_candidates.append(codename)
-        else:
-            noversion_codenames.append(codename)
-    csvfile.close()
-
-    testing_suite = testing_candidates[0]
-    rolling_suites = get_rolling_suites(origin)
-    suite_to_codename = {s: c for s, c in
-                         zip(rolling_suites,
-                             [testing_suite] + noversion_codenames)}
-
-    releases_order = [c for v, c in version_to_codename.items()]
-    # vendor specific updates
-    vendor_releases = {'debian': ['stable', 'proposed-updates',
-                                  'testing', 'testing-proposed-updates',
-                                  'unstable', 'sid'],
-                       'tmax': ['tmax-stable', 'tmax-proposed-updates',
-                                'tmax-testing', 'tmax-testing-proposed-updates',
-                                'tmax-unstable', 'gorani'],
-                       }
-    releases_order.extend(vendor_releases.get(origin.lower(), []))
-
-    return version_to_codename, suite_to_codename, releases_order
+release_version_re = re.compile(r'(\d+)\.(\d+)(r(\d+))?')
 
 def lookup_codename(release, version_to_codename, unknown=None):
-    m = re.match(r'(\d+)\.(\d+)(r(\d+))?', release)
+    m = release_version_re.match(release)
     if not m:
         return unknown
 
@@ -93,58 +203,149 @@ def lookup_codename(release, version_to_codename, unknown=None):
     return version_to_codename.get('{}.{}'.format(major, minor),
                                    version_to_codename.get(major, unknown))
 
-def valid_lsb_versions(version, module):
-    # If a module is ever released that only appears in >= version, deal
-    # with that here
-    if version == '3.0':
-        return ['2.0', '3.0']
-    elif version == '3.1':
-        if module in ('desktop', 'qt4'):
-            return ['3.1']
-        elif module == 'cxx':
-            return ['3.0', '3.1']
-        else:
-            return ['2.0', '3.0', '3.1']
-    elif version == '3.2':
-        if module == 'desktop':
-            return ['3.1', '3.2']
-        elif module == 'qt4':
-            return ['3.1']
-        elif module in ('printing', 'languages', 'multimedia'):
-            return ['3.2']
-        elif module == 'cxx':
-            return ['3.0', '3.1', '3.2']
-        else:
-            return ['2.0', '3.0', '3.1', '3.2']
-    elif version == '4.0':
-        if module == 'desktop':
-            return ['3.1', '3.2', '4.0']
-        elif module == 'qt4':
-            return ['3.1']
-        elif module in ('printing', 'languages', 'multimedia'):
-            return ['3.2', '4.0']
-        elif module == 'security':
-            return ['4.0']
-        elif module == 'cxx':
-            return ['3.0', '3.1', '3.2', '4.0']
-        else:
-            return ['2.0', '3.0', '3.1', '3.2', '4.0']
-    elif version == '4.1':
-        if module == 'desktop':
-            return ['3.1', '3.2', '4.0', '4.1']
-        elif module == 'qt4':
-            return ['3.1']
-        elif module in ('printing', 'languages', 'multimedia'):
-            return ['3.2', '4.0', '4.1']
-        elif module == 'security':
-            return ['4.0', '4.1']
-        elif module == 'cxx':
-            return ['3.0', '3.1', '3.2', '4.0', '4.1']
-        else:
-            return ['2.0', '3.0', '3.1', '3.2', '4.0', '4.1']
+# vendor specific updates, ordered after the numbered releases
+vendor_releases = {'debian': ['stable', 'proposed-updates',
+                              'testing', 'testing-proposed-updates',
+                              'unstable', 'sid'],
+                   'tmax': ['tmax-stable', 'tmax-proposed-updates',
+                            'tmax-testing', 'tmax-testing-proposed-updates',
+                            'tmax-unstable', 'gorani'],
+                   }
+
+# Parsed distro-info, memoized per origin; see get_distro_info()
+# { csv path: (mtime, DistroInfoDB) }
+_distro_info_cache = {}
+
+# Distinct release strings remembered by each DistroInfoDB.lookup_codename()
+CODENAME_MEMO_SIZE = 256
+
+class DistroInfoDB(object):
+    "The releases of one origin, indexed, from its distro-info CSV file."
+
+    def __init__(self, origin, csvfile):
+        self.origin = origin
+        self.version_to_codename = {}
+        self.codename_to_version = {}
+        noversion_codenames = []
+        testing_candidates = []
+        for row in csv.DictReader(csvfile):
+            version, codename, release = [row[x] for x in ('version', 'series',
+                                                           'release')]
+            if version:
+                self.version_to_codename[version] = codename
+                self.codename_to_version[codename] = version
+                if not release:
+                    testing_candidates.append(codename)
+            else:
+                noversion_codenames.append(codename)
+
+        testing_suite = testing_candidates[0]
+        rolling_suites = get_rolling_suites(origin)
+        self.suite_to_codename = {s: c for s, c in
+                                  zip(rolling_suites,
+                                      [testing_suite] + noversion_codenames)}
+
+        self.releases_order = list(self.version_to_codename.values())
+        self.releases_order.extend(vendor_releases.get(origin.lower(), []))
+        self.release_rank = get_release_ranks(self.releases_order)
+
+        # lookup_codename() answers, by release string
+        self._codenames = {}
+
+    @classmethod
+    @timed('distro_info')
+    def load(cls, origin='Debian'):
+        path = get_distro_info_path(origin)
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            # Unknown distro, fallback to Debian
+            origin = 'Debian'
+            path = get_distro_info_path(origin)
+            mtime = os.stat(path).st_mtime
+
+        loaded = _distro_info_cache.get(path)
+        if loaded and loaded[0] == mtime:
+            return loaded[1]
+        with open(path) as csvfile:
+            db = cls(origin, csvfile)
+        _distro_info_cache[path] = (mtime, db)
+        return db
+
+    def lookup_codename(self, release, unknown=None):
+        try:
+            codename = self._codenames[release]
+        except KeyError:
+            if len(self._codenames) >= CODENAME_MEMO_SIZE:
+                self._codenames.clear()
+            codename = lookup_codename(release, self.version_to_codename)
+            self._codenames[release] = codename
+        return unknown if codename is None else codename
+
+    def release_index(self, x):
+        return release_index(x, self.release_rank)
+
+def get_distro_info(origin='Debian'):
+    db = DistroInfoDB.load(origin)
+    return db.version_to_codename, db.suite_to_codename, db.releases_order
+
+try:
+    from types import MappingProxyType
+except ImportError:
+    # No read-only mappings in python2
+    MappingProxyType = dict
+
+# LSB versions known to this module, in release order
+LSB_VERSIONS = ('2.0', '3.0', '3.1', '3.2', '4.0', '4.1')
+# Modules have been versioned separately since LSB 3.1
+LSB_MODULES_SINCE = '3.1'
+# (first, last) LSB version each optional module appeared in; any other
+# module (core, graphics, ...) has been part of every version
+LSB_MODULE_VERSIONS = {
+    'cxx': ('3.0', None),
+    'desktop': ('3.1', None),
+    'qt4': ('3.1', '3.1'),
+    'printing': ('3.2', None),
+    'languages': ('3.2', None),
+    'multimedia': ('3.2', None),
+    'security': ('4.0', None),
+    }
+LSB_MODULES = ('core', 'cxx', 'desktop', 'graphics', 'languages',
+               'multimedia', 'printing', 'qt4', 'security')
 
+def build_lsb_module_matrix():
+    rank = {v: i for i, v in enumerate(LSB_VERSIONS)}
+    matrix = {}
+    for version in LSB_VERSIONS:
+        known = LSB_VERSIONS[:rank[version]+1]
+        # None holds the answer for modules without their own range
+        modules = {None: known}
+        for module in LSB_MODULES:
+            first, last = LSB_MODULE_VERSIONS.get(module, (None, None))
+            if (first is None or rank[version] < rank[LSB_MODULES_SINCE] or
+                rank[version] < rank[first]):
+                # If a module is ever released that only appears in >=
+                # version, it is valid for all versions before it
+                modules[module] = known
+            else:
+                last = rank[last] if last else len(LSB_VERSIONS)
+                modules[module] = tuple(v for v in known
+                                        if rank[first] <= rank[v] <= last)
+        matrix[version] = MappingProxyType(modules)
+    return MappingProxyType(matrix)
+
+lsb_module_matrix = build_lsb_module_matrix()
 
-    return [version]
+def get_lsb_module_matrix():
+    # { version: { module: (valid versions, ...) } }, modules not listed
+    # in LSB_MODULES are found under None
+    return lsb_module_matrix
+
+def valid_lsb_versions(version, module):
+    modules = lsb_module_matrix.get(version)
+    if modules is None:
+        return [version]
+    return list(modules.get(module, modules[None]))
 
 try:
     set # introduced in 2.4
@@ -152,9 +353,70 @@ except NameError:
     import sets
     set = sets.Set
 
+# Packages whose Provides tell which LSB modules are installed
+LSB_PACKAGES = ['lsb-' + module for module in LSB_MODULES]
+
+modnamere = re.compile(r'lsb-(?P<module>[a-z0-9]+)-(?P<arch>[^ ]+)(?: \(= (?P<version>[0-9.]+)\))?')
+
+def parse_lsb_provides(lines):
+    matrix = get_lsb_module_matrix()
+    modules = set()
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        version, sep, provides = line.partition(' ')
+        if not provides:
+            # Known to dpkg, but not installed
+            continue
+        # Debian package versions can be 3.2-$REV, 3.2+$REV or 3.2~$REV.
+        version = re.split('[-+~]', version, 1)[0]
+        for pkg in provides.split(','):
+            mob = modnamere.search(pkg)
+            if not mob:
+                continue
+
+            mgroups = mob.groupdict()
+            # If no versioned provides...
+            if mgroups.get('version'):
+                modules.add('%(module)s-%(version)s-%(arch)s' % mgroups)
+            else:
+                if version in matrix:
+                    versions = matrix[version].get(mgroups['module'],
+                                                   matrix[version][None])
+                else:
+                    versions = (version,)
+                for v in versions:
+                    mgroups['version'] = v
+                    modules.add('%(module)s-%(version)s-%(arch)s' % mgroups)
+
+    return sorted(modules)
+
 # This is Debian-specific at present
+@timed('check_modules_installed')
 def check_modules_installed():
-    return []
+    # Find which LSB modules are installed on this system, with a single
+    # dpkg-query run read as it streams
+    C_env = os.environ.copy(); C_env['LC_ALL'] = 'C'
+    with open(os.devnull, 'wb') as devnull:
+        try:
+            query = subprocess.Popen(['dpkg-query', '-f', '${Version} ${Provides}\n',
+                                      '-W'] + LSB_PACKAGES,
+                                     env=C_env,
+                                     stdout=subprocess.PIPE,
+                                     stderr=devnull,
+                                     close_fds=True)
+        except OSError:
+            # No dpkg here
+            return []
+        try:
+            lines = (line.decode('utf-8', 'replace') for line in query.stdout)
+            modules = parse_lsb_provides(lines)
+        finally:
+            query.stdout.close()
+            query.wait()
+
+    return modules
 
 longnames = {'v' : 'version', 'o': 'origin', 'a': 'suite',
              'c' : 'component', 'l': 'label'}
@@ -170,55 +432,307 @@ def parse_policy_line(data):
                 retval[longnames[k]] = v
     return retval
 
+def get_release_ranks(releases_order):
+    # { suite: release_index() }, the first occurrence ranking highest;
+    # a mapping is taken to be ranks already
+    if isinstance(releases_order, dict):
+        return releases_order
+    ranks = {}
+    for i, suite in enumerate(releases_order):
+        ranks.setdefault(suite, len(releases_order) - i)
+    return ranks
+
+def lookup_release_ranks(releases_order):
+    # The ranks a loaded DistroInfoDB already built for this very suite
+    # order (as returned by get_distro_info()), else fresh ones
+    if isinstance(releases_order, dict):
+        return releases_order
+    for mtime, db in _distro_info_cache.values():
+        if db.releases_order is releases_order:
+            return db.release_rank
+    return get_release_ranks(releases_order)
+
 def release_index(x, releases_order):
+    # releases_order is either the ordered list of suites or, much faster
+    # for repeated calls, get_release_ranks() of it
     suite = x[1].get('suite')
     if suite:
-        if suite in releases_order:
+        if isinstance(releases_order, dict):
+            rank = releases_order.get(suite)
+            if rank is not None:
+                return rank
+        elif suite in releases_order:
             return int(len(releases_order) - releases_order.index(suite))
-        else:
-            try:
-                return float(suite)
-            except ValueError:
-                return 0
+        try:
+            return float(suite)
+        except ValueError:
+            return 0
     return 0
 
 def compare_release(x, y, releases_order):
     warnings.warn('compare_release(x,y) is deprecated; please use the release_index(x) as key for sort() instead.', DeprecationWarning, stacklevel=2)
-    suite_x_i = release_index(x, releases_order)
-    suite_y_i = release_index(y, releases_order)
+    # Pass get_release_ranks() of a custom order to avoid rebuilding it
+    ranks = lookup_release_ranks(releases_order)
+    suite_x_i = release_index(x, ranks)
+    suite_y_i = release_index(y, ranks)
     
     try:
         return suite_x_i - suite_y_i
     except TypeError:
         return (suite_x_i > suite_y_i) - (suite_x_i < suite_y_i)
 
-def parse_apt_policy():
+policy_priority_re = re.compile(br'\s*(-?\d+)')
+policy_release_re = re.compile(br'\s*release (.*)')
+
+def parse_apt_policy_stream(lines):
     data = []
-    
-    C_env = os.environ.copy(); C_env['LC_ALL'] = 'C.UTF-8'
-    policy = subprocess.Popen(['apt-cache','policy'],
-                              env=C_env,
-                              stdout=subprocess.PIPE,
-                              stderr=subprocess.PIPE,
-                              close_fds=True).communicate()[0].decode('utf-8')
-    for line in policy.split('\n'):
-        line = line.strip()
-        m = re.match(r'(-?\d+)', line)
+    priority = None
+    for line in lines:
+        # Only the package files section tells us about releases
+        if line.startswith(b'Pinned packages:'):
+            break
+        m = policy_priority_re.match(line)
         if m:
             priority = int(m.group(1))
-        if line.startswith('release'):
-            bits = line.split(' ', 1)
-            if len(bits) > 1:
-                data.append( (priority, parse_policy_line(bits[1])) )
+            continue
+        m = policy_release_re.match(line)
+        if m:
+            bits = m.group(1).rstrip().decode('utf-8')
+            data.append( (priority, parse_policy_line(bits)) )
 
     return data
 
+@timed('apt_cache_policy')
+def parse_apt_policy():
+    C_env = os.environ.copy(); C_env['LC_ALL'] = 'C.UTF-8'
+    with open(os.devnull, 'wb') as devnull:
+        policy = subprocess.Popen(['apt-cache','policy'],
+                                  env=C_env,
+                                  stdout=subprocess.PIPE,
+                                  stderr=devnull,
+                                  close_fds=True)
+        try:
+            data = parse_apt_policy_stream(policy.stdout)
+        finally:
+            # We may stop reading early; apt-cache just gets EPIPE
+            policy.stdout.close()
+            policy.wait()
+
+    return data
+
+# Native reader for the apt lists, answering what parse_apt_policy() gets
+# from 'apt-cache policy' without starting apt
+def get_apt_lists_dir():
+    return os.environ.get('LSB_APT_LISTS', APT_LISTS_DIR)
+
+def get_apt_preferences():
+    return os.environ.get('LSB_APT_PREFERENCES', APT_PREFERENCES)
+
+def get_apt_conf():
+    return os.environ.get('LSB_APT_CONF', APT_CONF)
+
+conf_part_re = re.compile(r'^[A-Za-z0-9_-][A-Za-z0-9_.-]*$')
+
+def list_conf_parts(path, ext):
+    # path and the files of path.d, in the order apt reads them; like
+    # apt, only take the parts with no extension or with ext, so that
+    # *.dpkg-old, *.disabled and the like are left alone
+    paths = [path]
+    try:
+        parts = sorted(os.listdir(path + '.d'))
+    except OSError:
+        parts = []
+    for part in parts:
+        if not conf_part_re.match(part):
+            continue
+        if '.' not in part or part.endswith(ext):
+            paths.append(os.path.join(path + '.d', part))
+    return [p for p in paths if os.path.isfile(p)]
+
+release_fields = {'Origin': 'origin', 'Label': 'label', 'Suite': 'suite',
+                  'Version': 'version', 'Codename': 'codename',
+                  'Components': 'components',
+                  'NotAutomatic': 'notautomatic',
+                  'ButAutomaticUpgrades': 'butautomaticupgrades'}
+
+def parse_release_file(filename):
+    fields = {}
+    with io.open(filename, encoding='utf-8', errors='replace') as fh:
+        for line in fh:
+            if line.startswith('-----BEGIN PGP SIGNED MESSAGE'):
+                # Skip the armor headers of an InRelease file
+                for line in fh:
+                    if not line.strip():
+                        break
+                continue
+            if line.startswith('-----BEGIN PGP SIGNATURE') or line[:1].isspace():
+                break
+            key, sep, value = line.partition(':')
+            value = value.strip()
+            if not sep:
+                continue
+            if not value:
+                # The checksum lists are all that follows
+                break
+            if key in release_fields:
+                fields[release_fields[key]] = value
+    return fields
+
+def parse_pin(pin):
+    # 'release a=unstable, o=Debian' or 'origin "deb.debian.org"'
+    kind, sep, data = pin.strip().partition(' ')
+    data = data.strip()
+    if kind == 'origin':
+        return ('origin', data.strip('"'))
+    elif kind == 'release':
+        match = {}
+        for bit in data.split(','):
+            k, sep, v = bit.strip().partition('=')
+            if sep:
+                match[k.strip()] = v.strip()
+        if match:
+            return ('release', match)
+    return None
+
+def parse_apt_preferences():
+    pins = []
+    for path in list_conf_parts(get_apt_preferences(), '.pref'):
+        try:
+            with io.open(path, encoding='utf-8', errors='replace') as fh:
+                text = fh.read()
+        except IOError as msg:
+            print('Unable to open ' + path + ':', str(msg), file=sys.stderr)
+            continue
+        for stanza in re.split(r'\n\s*\n', text):
+            fields = {}
+            for line in stanza.splitlines():
+                if line.startswith('#'):
+                    continue
+                key, sep, value = line.partition(':')
+                if sep:
+                    fields[key.strip().lower()] = value.strip()
+            # Only the general pins affect the priorities of the releases
+            if fields.get('package') != '*' or 'pin' not in fields:
+                continue
+            pin = parse_pin(fields['pin'])
+            try:
+                priority = int(fields.get('pin-priority', ''))
+            except ValueError:
+                continue
+            if pin:
+                pins.append((pin, priority))
+    return pins
+
+pin_keys = {'a': 'suite', 'n': 'codename', 'v': 'version', 'o': 'origin',
+            'l': 'label', 'c': 'component'}
+
+def pin_value_matches(pattern, value):
+    if len(pattern) > 1 and pattern.startswith('/') and pattern.endswith('/'):
+        return re.search(pattern[1:-1], value) is not None
+    return fnmatch.fnmatchcase(value, pattern)
+
+def pin_matches(pin, site, release):
+    kind, data = pin
+    if kind == 'origin':
+        return data == site
+    for k, pattern in data.items():
+        if k not in pin_keys:
+            # Architecture pins cannot be told apart here
+            continue
+        if not pin_value_matches(pattern, release.get(pin_keys[k], '')):
+            return False
+    return True
+
+def apt_default_release_configured():
+    # APT::Default-Release pins the target release to 990, which only apt
+    # itself resolves reliably
+    if os.environ.get('APT_CONFIG'):
+        return True
+    for path in list_conf_parts(get_apt_conf(), '.conf'):
+        try:
+            with io.open(path, encoding='utf-8', errors='replace') as fh:
+                if 'default-release' in fh.read().lower():
+                    return True
+        except IOError:
+            continue
+    return False
+
+@timed('apt_lists')
+def parse_apt_lists():
+    listsdir = get_apt_lists_dir()
+    try:
+        names = sorted(os.listdir(listsdir))
+    except OSError:
+        return None
+
+    # Prefer InRelease over Release when apt kept both
+    releases = {}
+    for name in names:
+        for suffix in ('_Release', '_InRelease'):
+            if name.endswith(suffix):
+                base = name[:-len(suffix)]
+                if suffix == '_InRelease' or base not in releases:
+                    releases[base] = name
+    if not releases or apt_default_release_configured():
+        return None
+
+    packages = [name for name in names if '_Packages' in name]
+    pins = parse_apt_preferences()
+
+    data = [(100, {'suite': 'now'})]
+    for base in sorted(releases):
+        try:
+            release = parse_release_file(os.path.join(listsdir, releases[base]))
+        except IOError as msg:
+            print('Unable to open ' + releases[base] + ':', str(msg), file=sys.stderr)
+            continue
+
+        if release.get('notautomatic') == 'yes':
+            if release.get('butautomaticupgrades') == 'yes':
+                default_priority = 100
+            else:
+                default_priority = 1
+        else:
+            default_priority = 500
+
+        site = base.split('_', 1)[0]
+        components = release.get('components', '').split()
+        for component in components or ['']:
+            # apt-cache only reports the components we have indices for;
+            # 'updates/main' style components are fetched as plain 'main'
+            for candidate in (component, component.rsplit('/', 1)[-1]):
+                prefix = '_'.join(filter(None, (base, candidate.replace('/', '_'))))
+                if [p for p in packages if p.startswith(prefix + '_')]:
+                    component = candidate
+                    break
+            else:
+                continue
+
+            entry = dict(release)
+            if component:
+                entry['component'] = component
+            priority = default_priority
+            for pin, pin_priority in pins:
+                if pin_matches(pin, site, entry):
+                    priority = pin_priority
+                    break
+            data.append((priority, {k: v for k, v in entry.items()
+                                    if k in longnames.values()}))
+
+    return data
+
+def get_apt_policy():
+    data = parse_apt_lists()
+    if data is None:
+        data = parse_apt_policy()
+    return data
+
 def guess_release_from_apt(origin='Debian', component='main',
                            ignoresuites=('experimental'),
                            label='Debian',
-                           releases_order=get_distro_info('Debian')[2],
+                           releases_order=None,
                            alternate_olabels={'Debian Ports': ('ftp.ports.debian.org', 'ftp.debian-ports.org')}):
-    releases = parse_apt_policy()
+    releases = get_apt_policy()
 
     if not releases:
         return None
@@ -243,16 +757,27 @@ def guess_release_from_apt(origin='Debian', component='main',
 
     max_priority = releases[0][0]
     releases = [x for x in releases if x[0] == max_priority]
-    releases.sort(key=lambda x: release_index(x, releases_order))
+    if releases_order is None:
+        ranks = DistroInfoDB.load('Debian').release_rank
+    else:
+        ranks = lookup_release_ranks(releases_order)
+    releases.sort(key=lambda x: release_index(x, ranks))
 
     return releases[0][1]
 
-def guess_vendor_release():
-    distinfo = {}
+def get_etc_dpkg_origins_default():
+    return os.environ.get('LSB_ETC_DPKG_ORIGINS_DEFAULT','/etc/dpkg/origins/default')
 
-    distinfo['ID'] = 'Debian'
+def get_etc_vendor_version(vendor):
+    return os.environ.get(
+        'LSB_ETC_{}_VERSION'.format(vendor.upper()),
+        '/etc/{}_version'.format(vendor.lower()))
+
+@timed('dpkg_origins')
+def get_dpkg_vendor(default='Debian'):
+    vendor = default
     # Use /etc/dpkg/origins/default to fetch the distribution name
-    etc_dpkg_origins_default = os.environ.get('LSB_ETC_DPKG_ORIGINS_DEFAULT','/etc/dpkg/origins/default')
+    etc_dpkg_origins_default = get_etc_dpkg_origins_default()
     if os.path.exists(etc_dpkg_origins_default):
         try:
             with open(etc_dpkg_origins_default) as dpkg_origins_file:
@@ -262,18 +787,24 @@ def guess_vendor_release():
                         header = header.lower()
                         content = content.strip()
                         if header == 'vendor':
-                            distinfo['ID'] = content
+                            vendor = content
                     except ValueError:
                         pass
         except IOError as msg:
             print('Unable to open ' + etc_dpkg_origins_default + ':', str(msg), file=sys.stderr)
+    return vendor
+
+@timed('guess_vendor_release')
+def guess_vendor_release():
+    distinfo = {}
+
+    distinfo['ID'] = get_dpkg_vendor()
 
     # info for the correct distro
-    distro_info = get_distro_info(distinfo['ID'])
-    version_to_codename, suite_to_codename, releases_order = distro_info
+    db = DistroInfoDB.load(distinfo['ID'])
     rolling_suites = get_rolling_suites(distinfo['ID'])
     testing_suite, devel_suite, exp_suite = rolling_suites
-    testing_codename, devel_codename, exp_codename = [suite_to_codename[s]
+    testing_codename, devel_codename, exp_codename = [db.suite_to_codename[s]
                                                       for s in rolling_suites]
 
     kern = os.uname()[0]
@@ -288,9 +819,7 @@ def guess_vendor_release():
 
     distinfo['DESCRIPTION'] = '%(ID)s %(OS)s' % distinfo
 
-    etc_vendor_version = os.environ.get(
-        'LSB_ETC_{}_VERSION'.format(distinfo['ID'].upper()),
-        '/etc/{}_version'.format(distinfo['ID'].lower()))
+    etc_vendor_version = get_etc_vendor_version(distinfo['ID'])
     if os.path.exists(etc_vendor_version):
         try:
             with open(etc_vendor_version) as vendor_version:
@@ -302,7 +831,7 @@ def guess_vendor_release():
         devel_suffix = '/{}'.format(devel_codename)
         if not release[0:1].isalpha():
             # /etc/{}_version should be numeric
-            codename = lookup_codename(release, version_to_codename, 'n/a')
+            codename = db.lookup_codename(release, 'n/a')
             distinfo.update({ 'RELEASE' : release, 'CODENAME' : codename })
         elif release.endswith(devel_suffix):
             if release.rstrip(devel_suffix).lower() != testing_suite:
@@ -323,7 +852,7 @@ def guess_vendor_release():
       rinfo = guess_release_from_apt(origin=distinfo['ID'],
                                      label=distinfo['ID'],
                                      ignoresuites=exp_codename,
-                                     releases_order=releases_order)
+                                     releases_order=db.release_rank)
       if rinfo:
         release = rinfo.get('version')
 
@@ -333,7 +862,7 @@ def guess_vendor_release():
             rinfo.update({'suite': 'unstable'})
 
         if release:
-            codename = lookup_codename(release, version_to_codename, 'n/a')
+            codename = db.lookup_codename(release, 'n/a')
         else:
             release = rinfo.get('suite', devel_suite)
             if release == testing_suite:
@@ -350,9 +879,13 @@ def guess_vendor_release():
     return distinfo
 
 # Whatever is guessed above can be overridden in /usr/lib/os-release by derivatives
+def get_os_release_path():
+    return os.environ.get('LSB_OS_RELEASE', '/usr/lib/os-release')
+
+@timed('os_release')
 def get_os_release():
     distinfo = {}
-    os_release = os.environ.get('LSB_OS_RELEASE', '/usr/lib/os-release')
+    os_release = get_os_release_path()
     if os.path.exists(os_release):
         try:
             with open(os_release) as os_release_file:
@@ -383,6 +916,7 @@ def get_os_release():
 
     return distinfo
 
+@timed('get_distro_information')
 def get_distro_information():
     lsbinfo = get_os_release()
     # OS is only used inside guess_debian_release anyway
@@ -394,6 +928,156 @@ def get_distro_information():
     else:
         return lsbinfo
 
+# On-disk cache of get_distro_information(), keyed on the inputs it reads
+CACHE_VERSION = 1
+
+def get_cache_path():
+    cachefile = os.environ.get('LSB_RELEASE_CACHE')
+    if cachefile is not None:
+        # An empty LSB_RELEASE_CACHE disables the cache
+        return cachefile or None
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return os.path.join(runtime_dir, 'lsb_release.cache')
+    return '/var/cache/lsb-release/distro-information'
+
+def get_cache_inputs():
+    vendor = get_dpkg_vendor()
+    inputs = []
+    for path in (get_os_release_path(),
+                 get_etc_dpkg_origins_default(),
+                 get_etc_vendor_version(vendor),
+                 get_distro_info_path(vendor),
+                 get_distro_info_path('Debian'),
+                 get_apt_lists_dir(),
+                 get_apt_preferences(),
+                 get_apt_preferences() + '.d',
+                 get_apt_conf(),
+                 get_apt_conf() + '.d'):
+        if path not in inputs:
+            inputs.append(path)
+    return inputs
+
+def get_cache_environ():
+    return {k: v for k, v in os.environ.items()
+            if k.startswith('LSB_') and k != 'LSB_RELEASE_CACHE'}
+
+def stat_signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_ino, st.st_size, st.st_mtime]
+
+def load_cached_distro_information(cachefile):
+    try:
+        with open(cachefile) as fh:
+            cache = json.load(fh)
+    except (IOError, OSError, ValueError):
+        return None
+
+    try:
+        if (cache['version'] != CACHE_VERSION or
+            cache['environ'] != get_cache_environ()):
+            return None
+        for path, signature in cache['inputs']:
+            if stat_signature(path) != signature:
+                return None
+        return cache['distinfo']
+    except (KeyError, TypeError, ValueError):
+        # Corrupted or foreign cache file
+        return None
+
+def save_cached_distro_information(cachefile, inputs, distinfo):
+    cache = {'version': CACHE_VERSION,
+             'environ': get_cache_environ(),
+             'inputs': inputs,
+             'distinfo': distinfo}
+    # The directory is shipped by the package (or XDG_RUNTIME_DIR)
+    cachedir = os.path.dirname(cachefile) or '.'
+    try:
+        fd, tmpname = tempfile.mkstemp(prefix='.lsb_release-', dir=cachedir)
+    except (IOError, OSError):
+        # Not writable by this user; just go without a cache
+        return
+    try:
+        # mkstemp makes it 0600; everyone is to read the cache root writes
+        os.fchmod(fd, 0o644)
+        with os.fdopen(fd, 'w') as fh:
+            json.dump(cache, fh)
+        os.rename(tmpname, cachefile)
+    except (IOError, OSError):
+        try:
+            os.unlink(tmpname)
+        except OSError:
+            pass
+
+@timed('cache')
+def get_cached_distro_information(cachefile=None):
+    if cachefile is None:
+        cachefile = get_cache_path()
+    # While timing, the detection itself is what is to be measured
+    if not cachefile or stage_timer.enabled:
+        return get_distro_information()
+
+    distinfo = load_cached_distro_information(cachefile)
+    if distinfo is not None:
+        return distinfo
+
+    # Take the signatures before reading, so that anything changing
+    # underneath us invalidates the entry on the next run
+    inputs = [[path, stat_signature(path)] for path in get_cache_inputs()]
+    distinfo = get_distro_information()
+    save_cached_distro_information(cachefile, inputs, distinfo)
+    return distinfo
+
+# Fields shown by lsb_release, and their /etc/lsb-release style names
+lsb_release_fields = (('version', 'LSB_VERSION'),
+                      ('id', 'DISTRIB_ID'),
+                      ('description', 'DISTRIB_DESCRIPTION'),
+                      ('release', 'DISTRIB_RELEASE'),
+                      ('codename', 'DISTRIB_CODENAME'))
+LSB_FORMATS = ('shell', 'keyvalue', 'json')
+
+def get_lsb_field(distinfo, verinfo, field):
+    if field == 'version':
+        return ':'.join(verinfo) or 'n/a'
+    return distinfo.get(field.upper(), 'n/a')
+
+def shell_quote(value):
+    return "'" + value.replace("'", "'\\''") + "'"
+
+def format_distro_information(distinfo, verinfo, fmt):
+    if fmt == 'json':
+        fields = {field: get_lsb_field(distinfo, verinfo, field)
+                  for field, key in lsb_release_fields}
+        fields['version'] = list(verinfo)
+        return json.dumps(fields, sort_keys=True)
+    elif fmt not in LSB_FORMATS:
+        raise ValueError('unknown format ' + fmt)
+
+    lines = []
+    for field, key in lsb_release_fields:
+        value = get_lsb_field(distinfo, verinfo, field)
+        if fmt == 'shell':
+            value = shell_quote(value)
+        lines.append('%s=%s' % (key, value))
+    return '\n'.join(lines)
+
+def answer_lsb_query(distinfo, verinfo, query):
+    # A query is either a format name or a list of field names, the
+    # answer is what 'lsb_release -s' or '--format' would print
+    words = query.split()
+    if len(words) == 1 and words[0] in LSB_FORMATS:
+        return format_distro_information(distinfo, verinfo, words[0])
+    fields = dict(lsb_release_fields)
+    answer = []
+    for word in words:
+        if word not in fields:
+            raise ValueError('unknown query ' + word)
+        answer.append(get_lsb_field(distinfo, verinfo, word))
+    return '\n'.join(answer)
+
 def test():
     print(get_distro_information())
     print(check_modules_installed())
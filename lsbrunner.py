@@ -0,0 +1,110 @@
+# Running the system tools the LSB scripts call, without a shell
+from __future__ import print_function
+
+import os
+import sys
+import time
+import subprocess
+
+# Commands taking a regular expression as their last argument, which
+# can be merged with the same command for other expressions when they
+# come one after the other
+MERGEABLE = (
+    ('update-inetd', '--group', 'LSB', '--remove'),
+    )
+
+def tool_name(args):
+    return os.path.basename(args[0])
+
+def merge_key(args):
+    key = (tool_name(args),) + tuple(args[1:-1])
+    if key in MERGEABLE:
+        return key
+    return None
+
+# As few invocations as the same work takes: a command repeated right
+# after itself is only run once, and runs of mergeable commands become a
+# single one.  Repeats with other commands in between are all kept, as
+# those commands may undo what the first one did.
+def coalesce(commands):
+    result = []
+    previous = None
+    patterns = []
+    for args in commands:
+        args = list(args)
+        if args == previous:
+            continue
+        previous = args
+
+        key = merge_key(args)
+        if key and result and patterns and merge_key(result[-1]) == key:
+            if args[-1] not in patterns:
+                patterns.append(args[-1])
+                result[-1] = result[-1][:-1] + ['(?:%s)' % '|'.join(patterns)]
+            continue
+        patterns = key and [args[-1]] or []
+        result.append(args)
+    return result
+
+# Queues commands (argument lists) and runs them with run(), recording
+# how long each took.  Commands of the same group run one after the
+# other, in order; with jobs > 1, different groups run concurrently.
+# The group defaults to the name of the tool.
+class Runner(object):
+    def __init__(self, jobs=1, verbose=None):
+        self.jobs = jobs
+        if verbose is None:
+            verbose = bool(os.environ.get('LSB_DEBUG_TIMING'))
+        self.verbose = verbose
+        self.pending = []
+        # (args, status, seconds) of the commands run so far
+        self.timings = []
+
+    def add(self, args, group=None):
+        self.pending.append((group or tool_name(args), list(args)))
+
+    def call(self, args):
+        start = time.time()
+        try:
+            status = subprocess.call(args)
+        except OSError as why:
+            print('Unable to run %s: %s' % (args[0], why), file=sys.stderr)
+            status = 127
+        seconds = time.time() - start
+        self.timings.append((args, status, seconds))
+        if self.verbose:
+            print('%.3fs %d %s' % (seconds, status, ' '.join(args)),
+                  file=sys.stderr)
+        return status
+
+    def run_group(self, commands):
+        status = 0
+        for args in coalesce(commands):
+            status = self.call(args) or status
+        return status
+
+    # Returns the last non-zero exit status, or 0
+    def run(self):
+        groups = []
+        bygroup = {}
+        for group, args in self.pending:
+            if group not in bygroup:
+                bygroup[group] = []
+                groups.append(group)
+            bygroup[group].append(args)
+        self.pending = []
+
+        if self.jobs < 2 or len(groups) < 2:
+            status = 0
+            for group in groups:
+                status = self.run_group(bygroup[group]) or status
+            return status
+
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(min(self.jobs, len(groups))) as pool:
+            results = [pool.submit(self.run_group, bygroup[group])
+                       for group in groups]
+        status = 0
+        for result in results:
+            status = result.result() or status
+        return status
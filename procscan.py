@@ -0,0 +1,405 @@
+#!/usr/bin/python3
+
+# pidofproc for many daemons at once: the pid files are read and /proc
+# is scanned a single time for the whole list, instead of running kill,
+# ps and pidof for each of them.  Used by pidofprocs in init-functions.
+#
+# Usage: procscan.py [-p pidfile] daemon [[-p pidfile] daemon ...]
+#
+# One "status daemon [pid ...]" line is output for each daemon, status
+# being what pidofproc would return for it:
+#   0 running, 1 dead but the pid file exists, 3 not running,
+#   4 status unknown (e.g. unreadable pid file)
+#
+# With --stop [--retry=SECONDS], the daemons are stopped together, the
+# way killproc does it for one with start-stop-daemon --retry: TERM, a
+# wait of up to SECONDS (5) for all of them, then KILL and another wait.
+# The exits are waited for, not polled.  The lines then give 0 stopped,
+# 1 nothing running or 2 still running, and so does the exit status: 2
+# if any daemon is left, 0 if any was stopped, and 1 otherwise; 3 means
+# trouble, such as invalid arguments.
+from __future__ import print_function
+
+import os
+import sys
+import time
+import select
+import signal
+
+PROC = '/proc'
+PIDDIR = '/var/run'
+
+RUNNING = 0
+DEAD = 1
+NOT_RUNNING = 3
+UNKNOWN = 4
+
+# What is known of a process: its executable, argv and the kernel's
+# name for it (which, for scripts, is the name of the script)
+class Process(object):
+    def __init__(self, pid, proc=PROC):
+        self.pid = pid
+        path = os.path.join(proc, str(pid))
+        try:
+            self.exe = os.readlink(os.path.join(path, 'exe'))
+            if self.exe.endswith(' (deleted)'):
+                self.exe = self.exe[:-len(' (deleted)')]
+        except OSError:
+            # Not ours, or a kernel thread
+            self.exe = None
+        try:
+            self.root = os.readlink(os.path.join(path, 'root'))
+        except OSError:
+            self.root = None
+        with open(os.path.join(path, 'cmdline'), 'rb') as fh:
+            self.argv = [arg.decode('utf-8', 'replace') for arg in
+                         fh.read().split(b'\0') if arg]
+        with open(os.path.join(path, 'comm'), 'rb') as fh:
+            self.comm = fh.read().rstrip(b'\n').decode('utf-8', 'replace')
+
+    # The tests of pidof -x: the executable, the program in argv[0],
+    # or a script started through its interpreter
+    def matches(self, daemon):
+        base = os.path.basename(daemon)
+        if not self.argv:
+            return False
+        if self.exe == daemon:
+            return True
+        if self.argv[0] == daemon or os.path.basename(self.argv[0]) == base:
+            return True
+        if len(self.argv) > 1 and self.comm == base[:15]:
+            return (self.argv[1] == daemon or
+                    os.path.basename(self.argv[1]) == base)
+        return False
+
+# Whether the process has exited, zombies included
+def exited(pid, proc=PROC):
+    try:
+        with open(os.path.join(proc, str(pid), 'stat')) as fh:
+            state = fh.read().rsplit(')', 1)[1].split()[0]
+    except (IOError, OSError, IndexError):
+        return True
+    return state in ('Z', 'X')
+
+# An inotify descriptor watching the given pid files, which daemons
+# remove as they exit, or None if inotify cannot be had
+IN_ATTRIB = 0x4
+IN_DELETE_SELF = 0x400
+
+def watch_pidfiles(pidfiles):
+    try:
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (ImportError, OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    watched = [pidfile for pidfile in pidfiles if
+               libc.inotify_add_watch(fd, pidfile.encode('utf-8'),
+                                      IN_ATTRIB | IN_DELETE_SELF) >= 0]
+    if not watched:
+        os.close(fd)
+        return None
+    return fd
+
+# Signals a set of processes and waits for them to exit.  Each process
+# gets a pidfd when the kernel and Python have them (Linux 5.3, Python
+# 3.9), which is signalled instead of the pid, so that it cannot hit a
+# process reusing the pid, and which poll() reports when the process
+# exits.  The others are checked in /proc with a growing delay, woken
+# up early by inotify when one of the pid files goes.
+class ExitWatcher(object):
+    def __init__(self, pids, pidfiles=(), pidfds=True, proc=PROC):
+        self.proc = proc
+        self.alive = set(pids)
+        self.pidfds = {}
+        if pidfds and hasattr(os, 'pidfd_open') and \
+           hasattr(signal, 'pidfd_send_signal'):
+            for pid in pids:
+                try:
+                    self.pidfds[pid] = os.pidfd_open(pid)
+                except ProcessLookupError:
+                    self.alive.discard(pid)
+                except OSError:
+                    # No pidfds here (ENOSYS); the pid will do
+                    break
+        self.inotify = None
+        if self.alive - set(self.pidfds):
+            self.inotify = watch_pidfiles(pidfiles)
+
+    def kill(self, pid, sig):
+        try:
+            if pid in self.pidfds:
+                signal.pidfd_send_signal(self.pidfds[pid], sig)
+            else:
+                os.kill(pid, sig)
+        except ProcessLookupError:
+            self.alive.discard(pid)
+
+    # Returns the processes still alive after up to timeout seconds
+    def wait(self, timeout):
+        deadline = time.monotonic() + timeout
+        poller = select.poll()
+        fds = {}
+        for pid in self.alive:
+            if pid in self.pidfds:
+                fds[self.pidfds[pid]] = pid
+                poller.register(self.pidfds[pid], select.POLLIN)
+        if self.inotify is not None:
+            poller.register(self.inotify, select.POLLIN)
+
+        delay = 0.01
+        while True:
+            for pid in list(self.alive):
+                if pid not in self.pidfds and exited(pid, self.proc):
+                    self.alive.discard(pid)
+            remaining = deadline - time.monotonic()
+            if not self.alive or remaining <= 0:
+                break
+            if not self.alive - set(self.pidfds):
+                wait = remaining
+            else:
+                wait = min(remaining, delay)
+                delay = min(delay * 2, 0.25)
+            for fd, event in poller.poll(wait * 1000):
+                if fd == self.inotify:
+                    try:
+                        os.read(fd, 4096)
+                    except OSError:
+                        pass
+                    delay = 0.01
+                else:
+                    poller.unregister(fd)
+                    self.alive.discard(fds[fd])
+        return set(self.alive)
+
+    def close(self):
+        for fd in self.pidfds.values():
+            os.close(fd)
+        self.pidfds = {}
+        if self.inotify is not None:
+            os.close(self.inotify)
+            self.inotify = None
+
+# Lists the pids in /proc once, and reads the details of the processes
+# only when some daemon has to be looked up by name
+class ProcessTable(object):
+    def __init__(self, proc=PROC, omit=()):
+        self.proc = proc
+        self.omit = set(omit)
+        self.pids = set()
+        for name in os.listdir(proc):
+            if name.isdigit():
+                self.pids.add(int(name))
+        self._processes = None
+
+    def exists(self, pid):
+        return pid in self.pids
+
+    @property
+    def processes(self):
+        if self._processes is None:
+            try:
+                root = os.readlink(os.path.join(self.proc, 'self', 'root'))
+            except OSError:
+                root = None
+            self._processes = []
+            for pid in sorted(self.pids - self.omit):
+                try:
+                    process = Process(pid, self.proc)
+                except (IOError, OSError):
+                    # Gone since the listing
+                    continue
+                # pidof -c: only processes with the same root directory,
+                # as far as we can tell
+                if root and process.root and process.root != root:
+                    continue
+                self._processes.append(process)
+        return self._processes
+
+    def process(self, pid):
+        if pid not in self.pids:
+            return None
+        try:
+            return Process(pid, self.proc)
+        except (IOError, OSError):
+            return None
+
+    def find(self, daemon):
+        return [process.pid for process in self.processes
+                if process.matches(daemon)]
+
+# The pid of the first line of a pid file, '' if there is none, or None
+# for a pid file that does not exist; IOError if it cannot be read
+def read_pidfile(pidfile):
+    try:
+        with open(pidfile) as fh:
+            return fh.readline().strip()
+    except (IOError, OSError):
+        if not os.path.exists(pidfile):
+            return None
+        raise
+
+# Returns (status, pids) like pidofproc [-p pidfile] daemon
+def pidofproc(table, daemon, pidfile=None):
+    specified = pidfile is not None
+    if not specified:
+        pidfile = os.path.join(PIDDIR, os.path.basename(daemon) + '.pid')
+
+    try:
+        pid = read_pidfile(pidfile)
+    except (IOError, OSError):
+        return UNKNOWN, []
+
+    if pid is None:
+        if specified:
+            return NOT_RUNNING, []
+        pids = table.find(daemon)
+        if pids:
+            return RUNNING, pids
+        return NOT_RUNNING, []
+    elif pid:
+        if pid.isdigit() and table.exists(int(pid)):
+            return RUNNING, [int(pid)]
+        return DEAD, []
+
+    # An empty pid file
+    if specified:
+        return NOT_RUNNING, []
+    return UNKNOWN, []
+
+# services is a list of (daemon, pidfile or None); returns the
+# (status, pids) of each, in the same order
+def pidofprocs(services, proc=PROC, omit=None):
+    if omit is None:
+        # Like pidof -o %PPID, leave out the script asking
+        omit = (os.getpid(), os.getppid())
+    table = ProcessTable(proc, omit)
+    return [pidofproc(table, daemon, pidfile) for daemon, pidfile in services]
+
+STOPPED = 0
+NOTHING_RUNNING = 1
+STILL_RUNNING = 2
+TROUBLE = 3
+
+# What start-stop-daemon --stop --pidfile pidfile --name daemon would
+# signal: the process of the pid file, if its name is the daemon's
+def stop_target(table, daemon, pidfile=None):
+    if pidfile is None:
+        pidfile = os.path.join(PIDDIR, os.path.basename(daemon) + '.pid')
+    try:
+        pid = read_pidfile(pidfile)
+    except (IOError, OSError):
+        return None
+    if not pid or not pid.isdigit():
+        return None
+    process = table.process(int(pid))
+    if process is None or process.comm != os.path.basename(daemon)[:15]:
+        return None
+    return process.pid
+
+# Stops the daemons together: TERM, up to timeout seconds for all of
+# them to exit, then KILL for the ones left and the same wait.  Returns
+# the status of each, as start-stop-daemon --retry would.
+def stopprocs(services, timeout=5, proc=PROC, pidfds=True):
+    table = ProcessTable(proc)
+    targets = [stop_target(table, daemon, pidfile)
+               for daemon, pidfile in services]
+    pids = set(pid for pid in targets if pid is not None)
+    pidfiles = [pidfile or os.path.join(PIDDIR, os.path.basename(daemon) + '.pid')
+                for (daemon, pidfile), pid in zip(services, targets)
+                if pid is not None]
+
+    watcher = ExitWatcher(pids, pidfiles, pidfds, proc)
+    try:
+        alive = watcher.alive
+        for sig in (signal.SIGTERM, signal.SIGKILL):
+            for pid in list(alive):
+                watcher.kill(pid, sig)
+            alive = watcher.wait(timeout)
+            if not alive:
+                break
+    finally:
+        watcher.close()
+
+    statuses = []
+    for pid in targets:
+        if pid is None:
+            statuses.append(NOTHING_RUNNING)
+        elif pid in alive:
+            statuses.append(STILL_RUNNING)
+        else:
+            statuses.append(STOPPED)
+    return statuses
+
+def parse_args(args):
+    services = []
+    pidfile = None
+    args = list(args)
+    while args:
+        arg = args.pop(0)
+        if arg == '-p':
+            if not args:
+                raise ValueError('-p needs a pid file')
+            pidfile = args.pop(0)
+        elif arg.startswith('-p'):
+            pidfile = arg[2:]
+        else:
+            services.append((arg, pidfile))
+            pidfile = None
+    if pidfile is not None or not services:
+        raise ValueError('a daemon must follow each pid file')
+    return services
+
+def main(args):
+    args = list(args)
+    stop = False
+    timeout = 5
+    try:
+        while args and args[0].startswith('--'):
+            arg = args.pop(0)
+            if arg == '--stop':
+                stop = True
+            elif arg.startswith('--retry='):
+                timeout = float(arg[len('--retry='):])
+            else:
+                raise ValueError('unknown option %s' % arg)
+        services = parse_args(args)
+    except ValueError as why:
+        print('%s: invalid arguments: %s' % (sys.argv[0], why), file=sys.stderr)
+        if stop:
+            return TROUBLE
+        return UNKNOWN
+
+    if stop:
+        return main_stop(services, timeout)
+
+    # Everything is printed at once, so that a failure part way leaves
+    # nothing for the caller to mistake for results
+    lines = []
+    for (daemon, pidfile), (status, pids) in zip(services,
+                                                 pidofprocs(services)):
+        lines.append(' '.join([str(status), daemon] + [str(pid) for pid in pids]))
+    print('\n'.join(lines))
+    return 0
+
+def main_stop(services, timeout):
+    try:
+        statuses = stopprocs(services, timeout)
+    except Exception as why:
+        # Anything but the statuses below, so that killproc falls back
+        # to start-stop-daemon
+        print('%s: %s' % (sys.argv[0], why), file=sys.stderr)
+        return TROUBLE
+
+    print('\n'.join('%d %s' % (status, daemon) for (daemon, pidfile), status
+                    in zip(services, statuses)))
+    if STILL_RUNNING in statuses:
+        return STILL_RUNNING
+    elif STOPPED in statuses:
+        return STOPPED
+    return NOTHING_RUNNING
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,179 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+# Micro-benchmarks for initdutils, to be run from the source tree:
+#   PYTHONPATH=. python3 test/bench_initdutils.py [name...]
+
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+
+import initdutils as iu
+
+def report(name, seconds, number=1):
+	print('%-45s %12.2f us/call' % (name, seconds * 1e6 / number))
+
+def scan_initfile_lines(initfile):
+	# scan_initfile() as it was before it read the header block only
+	headerlines = ''
+	scanning = False
+	for line in open(initfile):
+		line = line.rstrip()
+		if iu.beginre.match(line):
+			scanning = True
+			continue
+		elif scanning and iu.endre.match(line):
+			scanning = False
+			continue
+		elif not scanning:
+			continue
+		if line.startswith('# '):
+			headerlines += line[2:] + '\n'
+		elif line.startswith('#\t'):
+			headerlines += line[1:] + '\n'
+
+	inheaders = iu.RFC822Parser(strob=headerlines)
+	headers = {}
+	for header, body in inheaders.items():
+		if not body.strip():
+			continue
+		if header in ('Default-Start', 'Default-Stop'):
+			headers[header] = list(map(int, body.split()))
+		elif header in ('Required-Start', 'Required-Stop', 'Provides',
+				'Should-Start', 'Should-Stop'):
+			headers[header] = body.split()
+		else:
+			headers[header] = body
+	return headers
+
+def bench_scan_initfile():
+	tmpdir = tempfile.mkdtemp()
+	try:
+		# The skeleton followed by a 4 MB embedded payload
+		payload = os.path.join(tmpdir, 'payload')
+		shutil.copy('test/init-skeleton', payload)
+		with open(payload, 'a') as fh:
+			fh.write('exit 0\n__PAYLOAD__\n')
+			for i in range(50000):
+				fh.write('%080d\n' % i)
+
+		for initfile, number in (('test/init-skeleton', 2000), (payload, 20)):
+			assert scan_initfile_lines(initfile) == iu.scan_initfile(initfile)
+			name = os.path.basename(initfile)
+			report('line by line scan of %s' % name,
+			       timeit.timeit(lambda: scan_initfile_lines(initfile),
+					     number=number), number)
+			report('scan_initfile of %s' % name,
+			       timeit.timeit(lambda: iu.scan_initfile(initfile),
+					     number=number), number)
+	finally:
+		shutil.rmtree(tmpdir)
+
+def bench_load_all_headers():
+	tmpdir = tempfile.mkdtemp()
+	try:
+		initdir = os.path.join(tmpdir, 'init.d')
+		os.mkdir(initdir)
+		for i in range(200):
+			shutil.copy('test/init-skeleton', os.path.join(initdir, 'script%d' % i))
+		indexfile = os.path.join(tmpdir, 'headers.db')
+		number = 20
+		report('scan_initfile of 200 scripts',
+		       timeit.timeit(lambda: [iu.scan_initfile(f) for f in
+					      iu.list_initscripts(initdir)],
+				     number=number), number)
+		iu.load_all_headers(initdir, indexfile)
+		report('load_all_headers of 200 scripts (warm)',
+		       timeit.timeit(lambda: iu.load_all_headers(initdir, indexfile),
+				     number=number), number)
+	finally:
+		shutil.rmtree(tmpdir)
+
+# What scripts do today: get_lsb_header_val from init-functions, once
+# per script and header
+SED_LOOP = r"""
+for f in "$1"/*; do
+	for h in Provides Required-Start Required-Stop Default-Start Default-Stop; do
+		v=$(sed -n "/^### BEGIN INIT INFO/,/^### END INIT INFO/ s/# $h: \+\(.*\)/\1/p" "$f")
+	done
+done
+"""
+
+def bench_header_query():
+	tmpdir = tempfile.mkdtemp()
+	try:
+		initdir = os.path.join(tmpdir, 'init.d')
+		os.mkdir(initdir)
+		for i in range(100):
+			shutil.copy('test/init-skeleton', os.path.join(initdir, 'script%d' % i))
+		indexfile = os.path.join(tmpdir, 'headers.db')
+		query = [sys.executable, 'initd_headers', '-i', indexfile, initdir]
+		number = 5
+		report('sed loop, 5 headers of 100 scripts',
+		       timeit.timeit(lambda: subprocess.check_call(['sh', '-c', SED_LOOP, 'sh', initdir]),
+				     number=number), number)
+		report('initd_headers, all headers of 100 scripts',
+		       timeit.timeit(lambda: subprocess.check_call(query + ['-n'],
+							stdout=subprocess.DEVNULL),
+				     number=number), number)
+		subprocess.check_call(query, stdout=subprocess.DEVNULL)
+		report('initd_headers, 100 scripts (warm index)',
+		       timeit.timeit(lambda: subprocess.check_call(query, stdout=subprocess.DEVNULL),
+				     number=number), number)
+	finally:
+		shutil.rmtree(tmpdir)
+
+def bench_lsbinstall_db():
+	tmpdir = tempfile.mkdtemp()
+	try:
+		filemap = dict((('lsb-package%d' % (i % 100), 'file%d' % i),
+				'/etc/profile.d/file%d' % i) for i in range(10000))
+		picklefile = os.path.join(tmpdir, 'lsbinstall')
+		dbfile = os.path.join(tmpdir, 'lsbinstall.db')
+		iu.save_lsbinstall_info(filemap, dbfile)
+		with open(picklefile, 'wb') as fh:
+			pickle.dump(filemap, fh)
+
+		def pickled():
+			# What lsbinstall meant to do: load, change, rewrite it all
+			with open(picklefile, 'rb') as fh:
+				filemap = pickle.load(fh)
+			filemap[('lsb-new', 'file')] = '/etc/profile.d/file'
+			with open(picklefile, 'wb') as fh:
+				pickle.dump(filemap, fh)
+		def sqlite():
+			db = iu.LsbInstallDB(dbfile)
+			db.get('lsb-new', 'file')
+			db.add('lsb-new', 'file', '/etc/profile.d/file')
+			db.close()
+		number = 50
+		report('pickle load + add + rewrite (10k entries)',
+		       timeit.timeit(pickled, number=number), number)
+		report('LsbInstallDB lookup + add (10k entries)',
+		       timeit.timeit(sqlite, number=number), number)
+
+		db = iu.LsbInstallDB(dbfile)
+		number = 10000
+		report('LsbInstallDB.get (10k entries)',
+		       timeit.timeit(lambda: db.get('lsb-package7', 'file4507'),
+				     number=number), number)
+		db.close()
+	finally:
+		shutil.rmtree(tmpdir)
+
+BENCHMARKS = [
+	bench_scan_initfile,
+	bench_load_all_headers,
+	bench_header_query,
+	bench_lsbinstall_db,
+]
+
+if __name__ == '__main__':
+	selected = sys.argv[1:]
+	for bench in BENCHMARKS:
+		if not selected or bench.__name__[len('bench_'):] in selected:
+			bench()
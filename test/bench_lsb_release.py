@@ -0,0 +1,272 @@
+#!/usr/bin/python3
+# coding=utf-8
+
+# Micro-benchmarks for lsb_release, to be run from the source tree:
+#   PATH=test/:${PATH} PYTHONPATH=. python3 test/bench_lsb_release.py [name...]
+
+import io
+import os
+import re
+import subprocess
+import sys
+import timeit
+
+import lsb_release as lr
+
+# Imports lsb_release in a fresh interpreter and reports the import time
+# and every file it opens that is not part of a Python module.
+IMPORT_PROBE = r'''
+import sys, time
+opened = []
+def hook(event, args):
+	if event == 'open' and isinstance(args[0], str) and \
+	   not args[0].endswith(('.py', '.pyc', '.so')):
+		opened.append(args[0])
+sys.addaudithook(hook)
+start = time.perf_counter()
+import lsb_release
+print(time.perf_counter() - start)
+for path in opened:
+	print(path)
+'''
+
+def report(name, seconds, number=1):
+	print('%-45s %12.2f us/call' % (name, seconds * 1e6 / number))
+
+def probe_import():
+	env = os.environ.copy()
+	env['PYTHONPATH'] = os.pathsep.join(
+		[os.path.dirname(os.path.abspath(lr.__file__))] + sys.path)
+	output = subprocess.check_output(
+		[sys.executable, '-S', '-B', '-c', IMPORT_PROBE], env=env)
+	lines = output.decode('utf-8').splitlines()
+	return float(lines[0]), lines[1:]
+
+def bench_import():
+	runs = [probe_import() for i in range(20)]
+	report('import lsb_release', min(t for t, opened in runs))
+	opened = runs[0][1]
+	print('%-45s %12d' % ('  files opened during import', len(opened)))
+	for path in opened:
+		print('    ' + path)
+
+def bench_get_distro_info():
+	number = 200
+	path = lr.get_distro_info_path('Debian')
+	def parse():
+		with open(path) as csvfile:
+			lr.DistroInfoDB('Debian', csvfile)
+	report('DistroInfoDB parse of debian.csv', timeit.timeit(parse, number=number),
+	       number)
+	report('get_distro_info (loaded)',
+	       timeit.timeit(lambda: lr.get_distro_info('Debian'), number=number),
+	       number)
+
+	db = lr.DistroInfoDB.load('Debian')
+	number = 10000
+	report('lookup_codename',
+	       timeit.timeit(lambda: lr.lookup_codename('12.5', db.version_to_codename),
+			     number=number), number)
+	report('DistroInfoDB.lookup_codename',
+	       timeit.timeit(lambda: db.lookup_codename('12.5'), number=number),
+	       number)
+
+def bench_apt_policy():
+	number = 20
+	os.environ['LSB_APT_LISTS'] = 'test/inexistant_dir'
+	os.environ['TEST_DEBIAN_APT_CACHE_UNSTABLE'] = '500'
+	report('parse_apt_policy (test/apt-cache)',
+	       timeit.timeit(lr.parse_apt_policy, number=number), number)
+	os.environ.pop('TEST_DEBIAN_APT_CACHE_UNSTABLE')
+
+	os.environ['LSB_APT_LISTS'] = 'test/apt-lists'
+	os.environ['LSB_APT_PREFERENCES'] = 'test/apt-preferences'
+	report('parse_apt_lists (test/apt-lists)',
+	       timeit.timeit(lr.parse_apt_lists, number=number), number)
+	os.environ.pop('LSB_APT_LISTS')
+	os.environ.pop('LSB_APT_PREFERENCES')
+
+def synthetic_policy(sources=50, pinned=10000):
+	lines = ['Package files:', ' 100 /var/lib/dpkg/status', '     release a=now']
+	for i in range(sources):
+		lines.append(' 500 http://mirror%d.example.org/debian sid/main amd64 Packages' % i)
+		lines.append('     release o=Debian,a=unstable,n=sid,l=Debian,c=main,b=amd64')
+		lines.append('     origin mirror%d.example.org' % i)
+	lines.append('Pinned packages:')
+	for i in range(pinned):
+		lines.append('     package%d -> 1.0-%d with priority 1001' % (i, i))
+	return ('\n'.join(lines) + '\n').encode('utf-8')
+
+def parse_apt_policy_buffered(output):
+	# What parse_apt_policy() did before it read apt-cache incrementally
+	data = []
+	for line in output.decode('utf-8').split('\n'):
+		line = line.strip()
+		m = re.match(r'(-?\d+)', line)
+		if m:
+			priority = int(m.group(1))
+		if line.startswith('release'):
+			bits = line.split(' ', 1)
+			if len(bits) > 1:
+				data.append( (priority, lr.parse_policy_line(bits[1])) )
+	return data
+
+def bench_apt_policy_stream():
+	number = 50
+	output = synthetic_policy()
+	assert parse_apt_policy_buffered(output) == \
+		lr.parse_apt_policy_stream(io.BytesIO(output))
+	report('buffered apt-cache policy parse',
+	       timeit.timeit(lambda: parse_apt_policy_buffered(output),
+			     number=number), number)
+	report('parse_apt_policy_stream',
+	       timeit.timeit(lambda: lr.parse_apt_policy_stream(io.BytesIO(output)),
+			     number=number), number)
+
+def valid_lsb_versions_ladder(version, module):
+	# valid_lsb_versions() as it was before the lookup table
+	if version == '3.0':
+		return ['2.0', '3.0']
+	elif version == '3.1':
+		if module in ('desktop', 'qt4'):
+			return ['3.1']
+		elif module == 'cxx':
+			return ['3.0', '3.1']
+		else:
+			return ['2.0', '3.0', '3.1']
+	elif version == '3.2':
+		if module == 'desktop':
+			return ['3.1', '3.2']
+		elif module == 'qt4':
+			return ['3.1']
+		elif module in ('printing', 'languages', 'multimedia'):
+			return ['3.2']
+		elif module == 'cxx':
+			return ['3.0', '3.1', '3.2']
+		else:
+			return ['2.0', '3.0', '3.1', '3.2']
+	elif version == '4.0':
+		if module == 'desktop':
+			return ['3.1', '3.2', '4.0']
+		elif module == 'qt4':
+			return ['3.1']
+		elif module in ('printing', 'languages', 'multimedia'):
+			return ['3.2', '4.0']
+		elif module == 'security':
+			return ['4.0']
+		elif module == 'cxx':
+			return ['3.0', '3.1', '3.2', '4.0']
+		else:
+			return ['2.0', '3.0', '3.1', '3.2', '4.0']
+	elif version == '4.1':
+		if module == 'desktop':
+			return ['3.1', '3.2', '4.0', '4.1']
+		elif module == 'qt4':
+			return ['3.1']
+		elif module in ('printing', 'languages', 'multimedia'):
+			return ['3.2', '4.0', '4.1']
+		elif module == 'security':
+			return ['4.0', '4.1']
+		elif module == 'cxx':
+			return ['3.0', '3.1', '3.2', '4.0', '4.1']
+		else:
+			return ['2.0', '3.0', '3.1', '3.2', '4.0', '4.1']
+	return [version]
+
+def bench_valid_lsb_versions():
+	number = 2000
+	pairs = [(v, m) for v in lr.LSB_VERSIONS + ('9.8',) for m in lr.LSB_MODULES]
+	for v, m in pairs:
+		assert valid_lsb_versions_ladder(v, m) == lr.valid_lsb_versions(v, m)
+
+	def ladder():
+		for v, m in pairs:
+			valid_lsb_versions_ladder(v, m)
+	def table():
+		for v, m in pairs:
+			lr.valid_lsb_versions(v, m)
+	def matrix():
+		matrix = lr.get_lsb_module_matrix()
+		for v, m in pairs:
+			modules = matrix.get(v)
+			if modules is not None:
+				modules[m]
+	report('if/elif ladder (%d lookups)' % len(pairs),
+	       timeit.timeit(ladder, number=number), number)
+	report('valid_lsb_versions (%d lookups)' % len(pairs),
+	       timeit.timeit(table, number=number), number)
+	report('get_lsb_module_matrix (%d lookups)' % len(pairs),
+	       timeit.timeit(matrix, number=number), number)
+
+def bench_cli():
+	script = os.path.join(os.path.dirname(os.path.abspath(lr.__file__)), 'lsb_release')
+	env = os.environ.copy()
+	env['LSB_RELEASE_CACHE'] = ''
+	env['TEST_DPKG_QUERY_NONE'] = '1'
+	def run(*args):
+		with open(os.devnull, 'wb') as devnull:
+			subprocess.check_call([sys.executable, script] + list(args),
+					      env=env, stdout=devnull, stderr=devnull)
+	def separate():
+		for option in ('-i', '-r', '-c'):
+			run('-s', option)
+	def combined():
+		run('--format', 'shell')
+	number = 5
+	report('lsb_release -s -i; -s -r; -s -c (3 processes)',
+	       timeit.timeit(separate, number=number), number)
+	report('lsb_release --format shell (1 process)',
+	       timeit.timeit(combined, number=number), number)
+
+def release_index_list(x, releases_order):
+	# release_index() as it was before the rank maps
+	suite = x[1].get('suite')
+	if suite:
+		if suite in releases_order:
+			return int(len(releases_order) - releases_order.index(suite))
+		else:
+			try:
+				return float(suite)
+			except ValueError:
+				return 0
+	return 0
+
+def bench_release_index():
+	# 5,000 releases at the same priority, from a multi-vendor setup with
+	# a long release history
+	releases_order = ['codename%d' % i for i in range(1000)] + \
+		list(lr.get_distro_info()[2])
+	suites = releases_order + ['%d.%d' % (i, i) for i in range(100)] + ['unknown']
+	policy = [(500, {'suite': suites[(i * 7919) % len(suites)]})
+		  for i in range(5000)]
+	ranks = lr.get_release_ranks(releases_order)
+	assert sorted(policy, key=lambda x: release_index_list(x, releases_order)) == \
+		sorted(policy, key=lambda x: lr.release_index(x, ranks))
+
+	def by_index():
+		return sorted(policy, key=lambda x: release_index_list(x, releases_order))
+	def by_rank():
+		# As guess_release_from_apt() does, ranks built once per sort
+		ranks = lr.get_release_ranks(releases_order)
+		return sorted(policy, key=lambda x: lr.release_index(x, ranks))
+	number = 5
+	report('sort 5000 releases by list.index',
+	       timeit.timeit(by_index, number=number), number)
+	report('sort 5000 releases by rank map',
+	       timeit.timeit(by_rank, number=number), number)
+
+BENCHMARKS = [
+	bench_import,
+	bench_get_distro_info,
+	bench_apt_policy,
+	bench_apt_policy_stream,
+	bench_valid_lsb_versions,
+	bench_cli,
+	bench_release_index,
+]
+
+if __name__ == '__main__':
+	selected = sys.argv[1:]
+	for bench in BENCHMARKS:
+		if not selected or bench.__name__[len('bench_'):] in selected:
+			bench()
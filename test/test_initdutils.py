@@ -1,31 +1,497 @@
 #!/usr/bin/python3
 import unittest
+import os
+import fcntl
+import json
+import shutil
+import tempfile
 
 import initdutils as iu
 
 class TestInitdUtils(unittest.TestCase):
 
-	@unittest.skip('Test not implemented.')
-	def test_scan_initfile():
-		raise NotImplementedError()
-	@unittest.skip('Test not implemented.')
-	def test_save_facilities():
-		raise NotImplementedError()
-	@unittest.skip('Test not implemented.')
-	def test_load_facilities():
-		raise NotImplementedError()
-	@unittest.skip('Test not implemented.')
-	def test_load_depends():
-		raise NotImplementedError()
-	@unittest.skip('Test not implemented.')
-	def test_save_depends():
-		raise NotImplementedError()
-	@unittest.skip('Test not implemented.')
-	def test_load_lsbinstall_info():
-		raise NotImplementedError()
-	@unittest.skip('Test not implemented.')
-	def test_save_lsbinstall_info():
-		raise NotImplementedError()
+	def test_scan_initfile(self):
+		headers = iu.scan_initfile('test/init-skeleton')
+		self.assertEqual(headers['Provides'], ['FOO'])
+		self.assertEqual(headers['Required-Start'], ['$syslog', '$remote_fs'])
+		self.assertEqual(headers['Default-Start'], [3, 5])
+		self.assertEqual(headers['Default-Stop'], [0, 1, 2, 6])
+		self.assertEqual(headers['Description'],
+				 'The FOO service is used for ZZZ\n'
+				 'The (long) description can spread multiple lines\n'
+				 'which start with \'#<TAB>\' or # followed by at least\n'
+				 'two spaces.')
+		self.assertEqual(headers['X-UnitedLinux-Default-Enabled'], 'yes')
+		self.assertEqual(len(headers), 10)
+		self.assertEqual(iu.scan_initfile('test/minid.pl'), {})
+
+	def test_scan_initfile_chunks(self):
+		# Markers straddling chunks, and nothing read past the end marker
+		with open('test/init-skeleton', 'rb') as fh:
+			skeleton = fh.read()
+		expected = iu.scan_initfile('test/init-skeleton')
+		chunk = iu.SCAN_CHUNK
+		try:
+			iu.SCAN_CHUNK = 7
+			self.assertEqual(iu.scan_initfile('test/init-skeleton'), expected)
+		finally:
+			iu.SCAN_CHUNK = chunk
+		tmpdir = tempfile.mkdtemp()
+		try:
+			initfile = os.path.join(tmpdir, 'payload')
+			with open(initfile, 'wb') as fh:
+				fh.write(b'#!/bin/sh\n#  ### BEGIN INIT INFO\n')
+				fh.write(b'# ' * iu.SCAN_CHUNK)
+				fh.write(skeleton.replace(b'### END INIT INFO',
+							  b'### END INIT INFO\n\xff' +
+							  b'\0' * (4 * iu.SCAN_CHUNK)))
+			self.assertEqual(iu.scan_initfile(initfile), expected)
+			self.assertEqual(len(iu.read_header_block(initfile)), 13)
+		finally:
+			shutil.rmtree(tmpdir)
+	def test_format_headers(self):
+		headers = {'test/init.d/dbus' : iu.scan_initfile('test/init.d/dbus')}
+		self.assertEqual(iu.format_headers(headers, 'shell', ['Provides', 'Default-Start', 'Nothing']),
+				 "LSB_PROVIDES='dbus'\nLSB_DEFAULT_START='2 3 4 5'")
+		self.assertEqual(iu.format_headers(headers, 'value', ['Required-Start']), '$remote_fs $syslog')
+		headers['test/init.d/avahi-daemon'] = {'Short-Description' : "Avahi's daemon"}
+		self.assertEqual(iu.format_headers(headers, 'shell', ['Short-Description']),
+				 "LSB_AVAHI_DAEMON_SHORT_DESCRIPTION='Avahi'\\''s daemon'\n"
+				 "LSB_DBUS_SHORT_DESCRIPTION='D-Bus systemwide message bus'")
+		self.assertEqual(json.loads(iu.format_headers(headers, 'json', ['Provides'])),
+				 {'test/init.d/dbus' : {'Provides' : ['dbus']}, 'test/init.d/avahi-daemon' : {}})
+		with self.assertRaises(ValueError):
+			iu.format_headers(headers, 'yaml')
+
+	def test_load_all_headers(self):
+		tmpdir = tempfile.mkdtemp()
+		try:
+			initdir = os.path.join(tmpdir, 'init.d')
+			shutil.copytree('test/init.d', initdir)
+			indexfile = os.path.join(tmpdir, 'headers.db')
+			headers = iu.load_all_headers(initdir, indexfile)
+			self.assertEqual(sorted(headers), [os.path.join(initdir, name) for name in
+							   ('avahi-daemon', 'cups', 'dbus', 'rsyslog')])
+			self.assertEqual(headers[os.path.join(initdir, 'dbus')]['Provides'], ['dbus'])
+
+			# A warm index reads nothing but changed scripts
+			scanned = []
+			scan_initfile = iu.scan_initfile
+			iu.scan_initfile = lambda initfile: scanned.append(initfile) or scan_initfile(initfile)
+			try:
+				self.assertEqual(iu.load_all_headers(initdir, indexfile), headers)
+				self.assertEqual(scanned, [])
+				cups = os.path.join(initdir, 'cups')
+				with open(cups, 'a') as fh:
+					fh.write('# more\n')
+				os.unlink(os.path.join(initdir, 'rsyslog'))
+				headers = iu.load_all_headers(initdir, indexfile)
+				self.assertEqual(scanned, [cups])
+				self.assertNotIn(os.path.join(initdir, 'rsyslog'), headers)
+			finally:
+				iu.scan_initfile = scan_initfile
+
+			with open(indexfile) as fh:
+				index = json.load(fh)
+			self.assertEqual(index['version'], iu.HEADERS_DB_VERSION)
+			self.assertEqual(len(index['scripts']), 3)
+
+			# An index from another version is ignored
+			index['version'] = 0
+			with open(indexfile, 'w') as fh:
+				json.dump(index, fh)
+			self.assertEqual(iu.HeadersIndex(indexfile).entries, {})
+		finally:
+			shutil.rmtree(tmpdir)
+
+	def test_headers_index(self):
+		self.assertEqual(iu.default_index('/etc/init.d/'), iu.HEADERS_DB)
+		self.assertEqual(iu.default_index('/etc/init.d/dbus'), iu.HEADERS_DB)
+		self.assertIsNone(iu.default_index('test/init.d'))
+		tmpdir = tempfile.mkdtemp()
+		try:
+			indexfile = os.path.join(tmpdir, 'headers.db')
+			# Other directories are indexed in memory
+			index = iu.HeadersIndex(None)
+			self.assertEqual(sorted(index.scan('test/init.d')),
+					 iu.list_initscripts('test/init.d'))
+			index.save()
+			index = iu.HeadersIndex(indexfile)
+			index.scan('test/init.d')
+			index.forget('test/init.d/dbus')
+			index.save()
+			self.assertNotIn('test/init.d/dbus', iu.HeadersIndex(indexfile).entries)
+			self.assertIn('test/init.d/cups', iu.HeadersIndex(indexfile).entries)
+		finally:
+			shutil.rmtree(tmpdir)
+
+	def test_save_facilities(self):
+		tmpdir = tempfile.mkdtemp()
+		try:
+			dbfile = os.path.join(tmpdir, 'facilities.db')
+			textfile = os.path.join(tmpdir, 'facilities')
+			facilities = {'dbus': {'/etc/init.d/dbus': (20, 19)},
+				      '$syslog': {'lsb': (10, 89)}}
+			iu.save_facilities(facilities, dbfile, textfile)
+			self.assertEqual(sorted(os.listdir(tmpdir)), ['facilities', 'facilities.db'])
+			# The text format is kept for older versions
+			with open(textfile) as fh:
+				self.assertEqual(fh.read(), '/etc/init.d/dbus dbus 20 19\n')
+			self.assertEqual(os.stat(dbfile).st_mode & 0o777, 0o644)
+			with open(dbfile) as fh:
+				self.assertEqual(json.load(fh), {'version': iu.DB_VERSION,
+					'facilities': {'dbus': {'/etc/init.d/dbus': [20, 19]}}})
+			iu.save_facilities({'$syslog': {'lsb': (10, 89)}}, dbfile, textfile)
+			self.assertEqual(os.listdir(tmpdir), [])
+		finally:
+			shutil.rmtree(tmpdir)
+
+	def test_load_facilities(self):
+		tmpdir = tempfile.mkdtemp()
+		try:
+			dbfile = os.path.join(tmpdir, 'facilities.db')
+			textfile = os.path.join(tmpdir, 'facilities')
+			self.assertEqual(iu.load_facilities(dbfile, textfile), {})
+			# The text format of older versions is read when there is
+			# no database yet
+			with open(textfile, 'w') as fh:
+				fh.write('/etc/init.d/dbus dbus 20 19\n'
+					 '/etc/init.d/avahi-daemon avahi 21 18\n'
+					 '/etc/init.d/avahi-daemon avahi-daemon 21 18\n')
+			facilities = iu.load_facilities(dbfile, textfile)
+			self.assertEqual(facilities['avahi'], {'/etc/init.d/avahi-daemon': (21, 18)})
+			self.assertEqual(len(facilities), 3)
+			iu.save_facilities(facilities, dbfile, textfile)
+			self.assertTrue(os.path.exists(dbfile))
+			self.assertEqual(iu.load_facilities(dbfile, textfile), facilities)
+			# An older version changed only the text file
+			with open(textfile, 'a') as fh:
+				fh.write('/etc/init.d/cups cups 22 17\n')
+			st = os.stat(dbfile)
+			os.utime(textfile, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+			self.assertEqual(iu.load_facilities(dbfile, textfile)['cups'],
+					 {'/etc/init.d/cups': (22, 17)})
+			os.unlink(textfile)
+			self.assertEqual(iu.load_facilities(dbfile, textfile), {})
+			iu.save_facilities(facilities, dbfile, textfile)
+			os.unlink(dbfile)
+			self.assertEqual(iu.load_facilities(dbfile, textfile), facilities)
+		finally:
+			shutil.rmtree(tmpdir)
+
+	def test_load_depends(self):
+		tmpdir = tempfile.mkdtemp()
+		try:
+			dbfile = os.path.join(tmpdir, 'depends.db')
+			textfile = os.path.join(tmpdir, 'depends')
+			with open(textfile, 'w') as fh:
+				fh.write('/etc/init.d/dbus: $remote_fs $syslog\n'
+					 '/etc/init.d/avahi-daemon: $remote_fs dbus\n')
+			depends = iu.load_depends(dbfile, textfile)
+			self.assertEqual(depends, {'/etc/init.d/dbus': ['$remote_fs', '$syslog'],
+						   '/etc/init.d/avahi-daemon': ['$remote_fs', 'dbus']})
+			iu.save_depends(depends, dbfile, textfile)
+			self.assertEqual(sorted(os.listdir(tmpdir)), ['depends', 'depends.db'])
+			self.assertEqual(iu.load_depends(dbfile, textfile), depends)
+			# An older version changed only the text file
+			with open(textfile, 'w') as fh:
+				fh.write('/etc/init.d/dbus: $remote_fs\n')
+			st = os.stat(dbfile)
+			os.utime(textfile, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+			self.assertEqual(iu.load_depends_index(dbfile, textfile),
+					 ({'/etc/init.d/dbus': ['$remote_fs']},
+					  {'$remote_fs': ['/etc/init.d/dbus']}))
+			iu.save_depends(depends, dbfile, textfile)
+			os.unlink(dbfile)
+			self.assertEqual(iu.load_depends(dbfile, textfile), depends)
+		finally:
+			shutil.rmtree(tmpdir)
+
+	def test_load_dependents(self):
+		tmpdir = tempfile.mkdtemp()
+		try:
+			dbfile = os.path.join(tmpdir, 'depends.db')
+			textfile = os.path.join(tmpdir, 'depends')
+			depends = {'/etc/init.d/dbus': ['$remote_fs', '$syslog'],
+				   '/etc/init.d/avahi-daemon': ['$remote_fs', 'dbus'],
+				   '/etc/init.d/cups': ['$syslog', 'avahi']}
+			dependents = {'$remote_fs': ['/etc/init.d/avahi-daemon', '/etc/init.d/dbus'],
+				      '$syslog': ['/etc/init.d/cups', '/etc/init.d/dbus'],
+				      'dbus': ['/etc/init.d/avahi-daemon'],
+				      'avahi': ['/etc/init.d/cups']}
+			self.assertEqual(iu.build_dependents(depends), dependents)
+			iu.save_depends(depends, dbfile, textfile)
+			with open(dbfile) as fh:
+				self.assertEqual(json.load(fh)['dependents'], dependents)
+			self.assertEqual(iu.load_depends_index(dbfile, textfile),
+					 (depends, dependents))
+			self.assertEqual(iu.load_dependents(dbfile, textfile), dependents)
+
+			# A database saved without the index gets it built
+			with open(dbfile, 'w') as fh:
+				json.dump({'version': iu.DB_VERSION, 'depends': depends}, fh)
+			self.assertEqual(iu.load_dependents(dbfile, textfile), dependents)
+		finally:
+			shutil.rmtree(tmpdir)
+
+	def test_save_depends(self):
+		tmpdir = tempfile.mkdtemp()
+		try:
+			dbfile = os.path.join(tmpdir, 'depends.db')
+			textfile = os.path.join(tmpdir, 'depends')
+			iu.save_depends({'/etc/init.d/dbus': ['$remote_fs']}, dbfile, textfile)
+			# A failed write leaves the database as it was
+			fsync = os.fsync
+			def fail(fd):
+				raise OSError('disk full')
+			os.fsync = fail
+			try:
+				with self.assertRaises(OSError):
+					iu.save_depends({'/etc/init.d/cups': ['$syslog']},
+							dbfile, textfile)
+			finally:
+				os.fsync = fsync
+			self.assertEqual(sorted(os.listdir(tmpdir)), ['depends', 'depends.db'])
+			self.assertEqual(iu.load_depends(dbfile, textfile),
+					 {'/etc/init.d/dbus': ['$remote_fs']})
+			iu.save_depends({}, dbfile, textfile)
+			self.assertEqual(os.listdir(tmpdir), [])
+		finally:
+			shutil.rmtree(tmpdir)
+
+	def test_database_lock(self):
+		tmpdir = tempfile.mkdtemp()
+		try:
+			lockfile = os.path.join(tmpdir, 'lock')
+			with iu.DatabaseLock(lockfile):
+				with open(lockfile) as fh:
+					with self.assertRaises(IOError):
+						fcntl.flock(fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+			with open(lockfile) as fh:
+				fcntl.flock(fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+			# The directory is created when missing
+			with iu.DatabaseLock(os.path.join(tmpdir, 'lsb', 'lock')):
+				pass
+		finally:
+			shutil.rmtree(tmpdir)
+
+	def test_load_lsbinstall_info(self):
+		tmpdir = tempfile.mkdtemp()
+		try:
+			dbfile = os.path.join(tmpdir, 'lsbinstall.db')
+			self.assertEqual(iu.load_lsbinstall_info(dbfile), {})
+			db = iu.LsbInstallDB(dbfile)
+			db.add('lsb-foo', 'foo.sh', '/etc/profile.d/foo.sh')
+			db.close()
+			self.assertEqual(iu.load_lsbinstall_info(dbfile),
+					 {('lsb-foo', 'foo.sh'): '/etc/profile.d/foo.sh'})
+		finally:
+			shutil.rmtree(tmpdir)
+
+	def test_save_lsbinstall_info(self):
+		tmpdir = tempfile.mkdtemp()
+		try:
+			dbfile = os.path.join(tmpdir, 'lsbinstall.db')
+			filemap = {('lsb-foo', 'foo.sh'): '/etc/profile.d/foo.sh',
+				   ('lsb-bar', 'foo.sh'): '/etc/profile.d/lsb-bar.foo.sh'}
+			iu.save_lsbinstall_info(filemap, dbfile)
+			self.assertEqual(iu.load_lsbinstall_info(dbfile), filemap)
+			del filemap[('lsb-bar', 'foo.sh')]
+			iu.save_lsbinstall_info(filemap, dbfile)
+			self.assertEqual(iu.load_lsbinstall_info(dbfile), filemap)
+			iu.save_lsbinstall_info({}, dbfile)
+			self.assertFalse(os.path.exists(dbfile))
+		finally:
+			shutil.rmtree(tmpdir)
+
+	def test_lsbinstall_db(self):
+		tmpdir = tempfile.mkdtemp()
+		try:
+			dbfile = os.path.join(tmpdir, 'lsbinstall.db')
+			db = iu.LsbInstallDB(dbfile)
+			db.add('lsb-foo', 'foo.sh', '/etc/profile.d/foo.sh')
+			self.assertEqual(db.get('lsb-foo', 'foo.sh'), '/etc/profile.d/foo.sh')
+			self.assertIsNone(db.get('lsb-foo', 'bar.sh'))
+			# A failed batch changes nothing
+			with self.assertRaises(ValueError):
+				with db:
+					db.add('lsb-foo', 'bar.sh', '/etc/profile.d/bar.sh')
+					db.remove('lsb-foo', 'foo.sh')
+					raise ValueError('failed')
+			self.assertEqual(db.items(), [(('lsb-foo', 'foo.sh'),
+						       '/etc/profile.d/foo.sh')])
+			with db:
+				db.add('lsb-foo', 'bar.sh', '/etc/profile.d/bar.sh')
+				db.remove('lsb-foo', 'foo.sh')
+			db.close()
+			self.assertEqual(iu.load_lsbinstall_info(dbfile),
+					 {('lsb-foo', 'bar.sh'): '/etc/profile.d/bar.sh'})
+		finally:
+			shutil.rmtree(tmpdir)
+
+	def test_services_file(self):
+		tmpdir = tempfile.mkdtemp()
+		try:
+			path = os.path.join(tmpdir, 'services')
+			shutil.copy('test/services', path)
+			services = iu.ServicesFile(path)
+			self.assertEqual(services.lookup(22, 'tcp').name, 'ssh')
+			self.assertEqual(services.lookup_name('mail', 'tcp').port, 25)
+			self.assertIsNone(services.lookup(22, 'udp'))
+			with self.assertRaises(ValueError):
+				services.add(4712, 'tcp', 'foo', ['mail'])
+			for port in range(4700, 4750):
+				services.add(port, 'tcp', 'foo%d' % port, package='lsb-foo')
+			services.add(22, 'tcp', 'ssh', ['secure-shell'])
+			self.assertFalse(services.remove(25, 'tcp'))
+			self.assertFalse(services.remove(4700, 'tcp', 'lsb-bar'))
+			self.assertTrue(services.remove(4701, 'tcp', 'lsb-foo'))
+			services.save()
+
+			with open('test/services') as fh:
+				original = fh.read().splitlines()
+			with open(path) as fh:
+				lines = fh.read().splitlines()
+			self.assertEqual(len(lines), len(original) + 49)
+			# Only the changed line is reformatted, comments are kept
+			changed = [line for line in lines[:len(original)] if line not in original]
+			self.assertEqual(changed, ['            ssh          22/tcp secure-shell # SSH Remote Login Protocol'])
+			self.assertEqual(lines[len(original)],
+					 '        foo4700        4700/tcp # Added by lsbinstall for lsb-foo')
+			with open(path + '~') as fh:
+				self.assertEqual(fh.read().splitlines(), original)
+
+			services = iu.ServicesFile(path)
+			self.assertEqual(services.lookup_name('secure-shell', 'tcp').port, 22)
+			self.assertIsNone(services.lookup(4701, 'tcp'))
+			self.assertEqual(services.lookup(4749, 'tcp').name, 'foo4749')
+		finally:
+			shutil.rmtree(tmpdir)
+
+	def test_list_initscripts(self):
+		scripts = iu.list_initscripts('test/init.d')
+		self.assertEqual([os.path.basename(s) for s in scripts],
+				 ['avahi-daemon', 'cups', 'dbus', 'rsyslog'])
+
+	def _scan_fixtures(self):
+		return dict((s, iu.scan_initfile(s))
+			    for s in iu.list_initscripts('test/init.d'))
+
+	def test_assign_priorities(self):
+		scripts = self._scan_fixtures()
+		facilities = dict(iu.OS_FACILITIES)
+		depends = {}
+		pri = iu.assign_priorities(scripts, facilities, depends)
+		self.assertEqual(pri, {'test/init.d/rsyslog': (25, 19),
+				       'test/init.d/dbus': (20, 19),
+				       'test/init.d/avahi-daemon': (26, 18),
+				       'test/init.d/cups': (27, 17)})
+		self.assertEqual(depends['test/init.d/avahi-daemon'], ['$remote_fs', 'dbus'])
+		self.assertEqual(facilities['avahi']['test/init.d/avahi-daemon'], (26, 18))
+		self.assertNotIn('test/init.d/cups', facilities['$syslog'])
+
+	def test_assign_priorities_order(self):
+		# Installing the whole set at once gives what installing the
+		# scripts one by one, dependencies first, would
+		scripts = self._scan_fixtures()
+		pri = iu.assign_priorities(scripts, dict(iu.OS_FACILITIES), {})
+		facilities = dict(iu.OS_FACILITIES)
+		single = {}
+		for name in ('dbus', 'rsyslog', 'avahi-daemon', 'cups'):
+			initfile = 'test/init.d/' + name
+			single.update(iu.assign_priorities({initfile: scripts[initfile]},
+							   facilities, {}))
+		self.assertEqual(single, pri)
+
+	def test_dependency_graph(self):
+		scripts = self._scan_fixtures()
+		graph = iu.DependencyGraph()
+		avahi = scripts.pop('test/init.d/avahi-daemon')
+		graph.add(scripts)
+		self.assertEqual(graph.priority('test/init.d/cups'), (20, 19))
+		# Only avahi-daemon and what depends on it get re-ranked
+		changed = graph.add({'test/init.d/avahi-daemon': avahi})
+		self.assertEqual(changed, set(['test/init.d/avahi-daemon',
+					       'test/init.d/cups']))
+		self.assertEqual(graph.priority('test/init.d/cups'), (27, 17))
+		self.assertEqual(graph.descendants(['test/init.d/dbus'], 'start'),
+				 set(['test/init.d/dbus', 'test/init.d/avahi-daemon',
+				      'test/init.d/cups']))
+		changed = graph.remove(['test/init.d/avahi-daemon'])
+		self.assertEqual(changed, set(['test/init.d/cups']))
+		self.assertEqual(graph.priority('test/init.d/cups'), (20, 19))
+
+	def test_dependency_graph_external(self):
+		# A provider only in the facilities database still counts when
+		# the graph has another one
+		facilities = dict(iu.OS_FACILITIES)
+		facilities['web'] = {'/etc/init.d/apache2': (40, 10)}
+		graph = iu.DependencyGraph(facilities)
+		graph.add({'nginx': {'Provides': ['web']},
+			   'proxy': {'Provides': ['proxy'], 'Required-Start': ['web'],
+				     'Required-Stop': ['web']}})
+		self.assertEqual(graph.priority('proxy'), (41, 9))
+
+	def test_assign_priorities_dependents(self):
+		# cups was registered before; installing avahi-daemon, which it
+		# should start after, registers it again
+		scripts = self._scan_fixtures()
+		avahi = scripts.pop('test/init.d/avahi-daemon')
+		facilities = dict(iu.OS_FACILITIES)
+		depends = {}
+		graph = iu.DependencyGraph(facilities)
+		iu.assign_priorities(scripts, facilities, depends, graph)
+		self.assertEqual(facilities['cups']['test/init.d/cups'], (20, 19))
+		pri = iu.assign_priorities({'test/init.d/avahi-daemon': avahi},
+					   facilities, depends, graph)
+		self.assertEqual(pri, {'test/init.d/avahi-daemon': (26, 18),
+				       'test/init.d/cups': (27, 17)})
+		self.assertEqual(facilities['cups']['test/init.d/cups'], (27, 17))
+
+	def test_dependency_graph_loop(self):
+		graph = iu.DependencyGraph()
+		graph.add({'a': {'Provides': ['a'], 'Required-Start': ['b']},
+			   'b': {'Provides': ['b'], 'Should-Start': ['c']}},
+			  strict=False)
+		with self.assertRaises(ValueError):
+			graph.add({'c': {'Provides': ['c'], 'Required-Start': ['a']}})
+		self.assertNotIn('c', graph.headers)
+		self.assertEqual(graph.priority('a'), (6, iu.DEFAULT_PRIORITY))
+
+	def test_levels(self):
+		graph = iu.DependencyGraph()
+		graph.add(self._scan_fixtures())
+		self.assertEqual(graph.levels(),
+				 [['test/init.d/dbus', 'test/init.d/rsyslog'],
+				  ['test/init.d/avahi-daemon'], ['test/init.d/cups']])
+		self.assertEqual(graph.levels('stop'),
+				 [['test/init.d/cups', 'test/init.d/rsyslog'],
+				  ['test/init.d/avahi-daemon'], ['test/init.d/dbus']])
+		self.assertEqual(iu.format_levels(graph).split('\n'),
+				 ['TARGETS = dbus rsyslog avahi-daemon cups',
+				  'avahi-daemon: dbus rsyslog',
+				  'cups: avahi-daemon'])
+		levels = json.loads(iu.format_levels(graph, 'json', 'stop'))
+		self.assertEqual(levels['levels'], [['cups', 'rsyslog'],
+						    ['avahi-daemon'], ['dbus']])
+		self.assertEqual(levels['depends']['dbus'], ['avahi-daemon'])
+
+	def test_critical_path(self):
+		graph = iu.DependencyGraph()
+		graph.add(self._scan_fixtures())
+		timings = iu.load_timings('test/init.d-timings')
+		timings = dict(('test/init.d/' + name, t) for name, t in timings.items())
+		length, path = graph.critical_path(timings)
+		self.assertAlmostEqual(length, 3.6)
+		self.assertEqual(path, ['test/init.d/rsyslog',
+					'test/init.d/avahi-daemon', 'test/init.d/cups'])
+		self.assertAlmostEqual(sum(timings.values()), 3.9)
+
+	def test_assign_priorities_missing(self):
+		scripts = {'test/init.d/dbus': {'Provides': ['dbus'],
+						'Required-Start': ['$remote_fs', 'hal']}}
+		with self.assertRaises(ValueError):
+			iu.assign_priorities(scripts, dict(iu.OS_FACILITIES), {})
 
 if __name__ == '__main__':
 	unittest.main()
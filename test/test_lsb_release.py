@@ -33,6 +33,19 @@ def get_arch_distinfo(vendor='Debian'):
 
 class TestLSBRelease(unittest.TestCase):
 
+	def setUp(self):
+		# Unless a test points it at test/apt-lists, keep the native apt
+		# lists reader away from the host so that the test/apt-cache
+		# stand-in is used
+		self.apt_lists = os.environ.get('LSB_APT_LISTS')
+		os.environ['LSB_APT_LISTS'] = 'test/inexistant_dir'
+
+	def tearDown(self):
+		if self.apt_lists is None:
+			os.environ.pop('LSB_APT_LISTS', None)
+		else:
+			os.environ['LSB_APT_LISTS'] = self.apt_lists
+
 	def test_debian_lookup_codename(self):
 		# Test all versions
 		vendor = 'Debian'
@@ -100,11 +113,46 @@ class TestLSBRelease(unittest.TestCase):
 									 [elem for elem in in_versions if int(float(elem)*10) <= int(float(test_v)*10)],
 									 assert_text)
 
+	def test_lsb_module_matrix(self):
+		matrix = lr.get_lsb_module_matrix()
+		self.assertEqual(sorted(matrix), sorted(lr.LSB_VERSIONS))
+		for version, modules in matrix.items():
+			for module in lr.LSB_MODULES + ('x-' + rnd_string(1,9),):
+				self.assertEqual(list(modules.get(module, modules[None])),
+						 lr.valid_lsb_versions(version, module))
+		# Unknown LSB versions only validate themselves
+		self.assertEqual(lr.valid_lsb_versions('9.8', 'core'), ['9.8'])
+		# The matrix is shared, so it must not be writable
+		with self.assertRaises(TypeError):
+			matrix['9.8'] = {}
+		with self.assertRaises(TypeError):
+			matrix['4.1']['core'] = ()
+
 	def test_check_modules_installed(self):
 		# Test that when no packages are available, then we get nothing out.
 		os.environ['TEST_DPKG_QUERY_NONE'] = '1'
 		self.assertEqual(lr.check_modules_installed(),[])
 		os.environ.pop('TEST_DPKG_QUERY_NONE')
+		# Test that all packages with an unknown LSB version only give that version
+		os.environ['TEST_DPKG_QUERY_ALL'] = '1'
+		supposed_output = []
+		for package in lr.LSB_PACKAGES:
+			module = package[len('lsb-'):]
+			supposed_output += [module + '-9.8-TESTarch', module + '-9.8-noarch']
+		self.assertEqual(lr.check_modules_installed(),sorted(supposed_output))
+		os.environ.pop('TEST_DPKG_QUERY_ALL')
+
+	def test_parse_lsb_provides(self):
+		lines = ['4.1-1 lsb-desktop-amd64, lsb-desktop-noarch\n',
+			 '4.1+Debian13 lsb-core-amd64 (= 3.2), lsb-core-noarch\n',
+			 ' \n',
+			 '\n']
+		supposed_output = ['core-2.0-noarch', 'core-3.0-noarch', 'core-3.1-noarch',
+				   'core-3.2-amd64', 'core-3.2-noarch', 'core-4.0-noarch',
+				   'core-4.1-noarch', 'desktop-3.1-amd64', 'desktop-3.1-noarch',
+				   'desktop-3.2-amd64', 'desktop-3.2-noarch', 'desktop-4.0-amd64',
+				   'desktop-4.0-noarch', 'desktop-4.1-amd64', 'desktop-4.1-noarch']
+		self.assertEqual(lr.parse_lsb_provides(lines),supposed_output)
 
 	def test_parse_policy_line(self):
 		release_line = ''
@@ -138,6 +186,27 @@ class TestLSBRelease(unittest.TestCase):
 				 supposed_output,
 				 'compare_release(' + x[1]['suite'] + ',' + y[1]['suite'] + ') =? ' + str(supposed_output))
 
+	def test_release_ranks(self):
+		releases_order = lr.get_distro_info()[2]
+		# Duplicates keep the rank of their first occurrence
+		releases_order = releases_order + releases_order[:2]
+		ranks = lr.get_release_ranks(releases_order)
+		self.assertIs(lr.get_release_ranks(ranks), ranks)
+		for suite in releases_order + ['1.5', rnd_string(1,9)]:
+			x = [rnd_string(1,12), {'suite': suite}]
+			self.assertEqual(lr.release_index(x, ranks), lr.release_index(x, releases_order))
+		with warnings.catch_warnings():
+			warnings.simplefilter('ignore', DeprecationWarning)
+			x = [rnd_string(1,12), {'suite': releases_order[0]}]
+			y = [rnd_string(1,12), {'suite': releases_order[1]}]
+			self.assertEqual(lr.compare_release(x, y, ranks), 1)
+			self.assertEqual(lr.compare_release(x, y, releases_order), 1)
+		# The ranks of a distro-info order are built once, with its database
+		db = lr.DistroInfoDB.load('Debian')
+		self.assertIs(lr.lookup_release_ranks(db.releases_order), db.release_rank)
+		self.assertIs(lr.lookup_release_ranks(ranks), ranks)
+		self.assertEqual(lr.lookup_release_ranks(releases_order), ranks)
+
 	def test_parse_apt_policy(self):
 		# Test almost-empty apt-cache policy
 		supposed_output = [(100, {'suite': 'now'})]
@@ -158,6 +227,60 @@ class TestLSBRelease(unittest.TestCase):
 		os.environ.pop('TEST_DEBIAN_APT_CACHE2')
 		os.environ.pop('TEST_DEBIAN_APT_CACHE3')
 
+	def test_parse_apt_policy_stream(self):
+		def policy():
+			yield b'Package files:\n'
+			yield b' 100 /var/lib/dpkg/status\n'
+			yield b'     release a=now\n'
+			yield b'-10 http://Mirror_is_not_read/ sid/main arch Packages\n'
+			yield b'     release o=oRigIn,a=SuiTe,l=lABel,c=C0mp0nent\n'
+			yield b'     origin Mirror-is-not-read\n'
+			yield b'Pinned packages:\n'
+			raise AssertionError('Pinned packages should not be read')
+		supposed_output = [(100, {'suite': 'now'}),
+				   (-10, {'origin': 'oRigIn', 'suite': 'SuiTe', 'component': 'C0mp0nent', 'label': 'lABel'})]
+		self.assertEqual(lr.parse_apt_policy_stream(policy()),supposed_output)
+
+	def test_parse_apt_lists(self):
+		# Test that no lists leads to the apt-cache fallback
+		self.assertEqual(lr.parse_apt_lists(),None)
+		self.assertEqual(lr.get_apt_policy(),lr.parse_apt_policy())
+
+		os.environ['LSB_APT_LISTS'] = 'test/apt-lists'
+		os.environ['LSB_APT_PREFERENCES'] = 'test/apt-preferences'
+		os.environ['LSB_APT_CONF'] = 'test/inexistant_file_' + rnd_string(2,5)
+		supposed_output = [
+			(100, {'suite': 'now'}),
+			(500, {'origin': 'Debian', 'label': 'Debian', 'suite': 'stable', 'version': '12.5', 'component': 'main'}),
+			(500, {'origin': 'Debian', 'label': 'Debian', 'suite': 'stable', 'version': '12.5', 'component': 'contrib'}),
+			# NotAutomatic with ButAutomaticUpgrades
+			(100, {'origin': 'Debian Backports', 'label': 'Debian Backports', 'suite': 'stable-backports', 'component': 'main'}),
+			# NotAutomatic
+			(1, {'origin': 'Debian', 'label': 'Debian', 'suite': 'experimental', 'component': 'main'}),
+			# Pinned by release
+			(200, {'origin': 'Debian', 'label': 'Debian', 'suite': 'unstable', 'component': 'main'}),
+			# Pinned by origin, with an updates/main component
+			(600, {'origin': 'Debian', 'label': 'Debian-Security', 'suite': 'stable-security', 'version': '12', 'component': 'main'}),
+		]
+		# Like apt, the backup left by dpkg in preferences.d is ignored
+		self.assertEqual(lr.list_conf_parts('test/apt-preferences', '.pref'),
+				 ['test/apt-preferences', 'test/apt-preferences.d/security'])
+		self.assertEqual(lr.parse_apt_lists(),supposed_output)
+		self.assertEqual(lr.get_apt_policy(),supposed_output)
+		self.assertEqual(lr.guess_release_from_apt(),supposed_output[1][1])
+
+		# Test that APT::Default-Release makes way for apt-cache
+		fn = 'test/apt.conf_' + rnd_string(5,12)
+		f = open(fn,'w')
+		f.write('APT::Default-Release "unstable";\n')
+		f.close()
+		os.environ['LSB_APT_CONF'] = fn
+		self.assertEqual(lr.parse_apt_lists(),None)
+		os.remove(fn)
+
+		os.environ.pop('LSB_APT_PREFERENCES')
+		os.environ.pop('LSB_APT_CONF')
+
 	def test_debian_guess_release_from_apt(self):
 		vendor = 'Debian'
 		releases_order = lr.get_distro_info(vendor)[2]
@@ -431,6 +554,77 @@ class TestLSBRelease(unittest.TestCase):
 		other_distro_info = lr.get_distro_info(origin='x-not-debian')
 		self.assertEqual(debian_info, other_distro_info)
 
+	def test_format_distro_information(self):
+		distinfo = {'ID': 'Debian', 'RELEASE': '12', 'CODENAME': 'bookworm',
+			    'DESCRIPTION': "Debian's GNU/Linux 12 (bookworm)"}
+		verinfo = ['core-4.1-amd64', 'core-4.1-noarch']
+		self.assertEqual(lr.format_distro_information(distinfo, verinfo, 'shell'),
+				 "LSB_VERSION='core-4.1-amd64:core-4.1-noarch'\n"
+				 "DISTRIB_ID='Debian'\n"
+				 "DISTRIB_DESCRIPTION='Debian'\\''s GNU/Linux 12 (bookworm)'\n"
+				 "DISTRIB_RELEASE='12'\n"
+				 "DISTRIB_CODENAME='bookworm'")
+		self.assertEqual(lr.format_distro_information({}, [], 'keyvalue'),
+				 'LSB_VERSION=n/a\nDISTRIB_ID=n/a\nDISTRIB_DESCRIPTION=n/a\n'
+				 'DISTRIB_RELEASE=n/a\nDISTRIB_CODENAME=n/a')
+		import json
+		self.assertEqual(json.loads(lr.format_distro_information(distinfo, verinfo, 'json')),
+				 {'version': verinfo, 'id': 'Debian', 'release': '12',
+				  'codename': 'bookworm', 'description': distinfo['DESCRIPTION']})
+		self.assertRaises(ValueError, lr.format_distro_information, distinfo, verinfo, rnd_string(1,9))
+
+	def test_answer_lsb_query(self):
+		distinfo = {'ID': 'Debian', 'RELEASE': '12', 'CODENAME': 'bookworm'}
+		self.assertEqual(lr.answer_lsb_query(distinfo, [], 'id'), 'Debian')
+		self.assertEqual(lr.answer_lsb_query(distinfo, [], ' release  codename\n'), '12\nbookworm')
+		self.assertEqual(lr.answer_lsb_query(distinfo, [], 'description version'), 'n/a\nn/a')
+		self.assertEqual(lr.answer_lsb_query(distinfo, [], 'keyvalue'),
+				 lr.format_distro_information(distinfo, [], 'keyvalue'))
+		self.assertRaises(ValueError, lr.answer_lsb_query, distinfo, [], 'id ' + rnd_string(1,9))
+
+	def test_distro_info_db(self):
+		# The CSV is parsed once per file
+		db = lr.DistroInfoDB.load('Debian')
+		self.assertIs(lr.DistroInfoDB.load('debian'), db)
+		self.assertIs(lr.DistroInfoDB.load('x-not-debian'), db)
+		self.assertEqual(lr.get_distro_info('Debian'),
+				 (db.version_to_codename, db.suite_to_codename, db.releases_order))
+		with open(lr.get_distro_info_path('Debian')) as csvfile:
+			fresh = lr.DistroInfoDB('Debian', csvfile)
+		self.assertEqual(fresh.releases_order, db.releases_order)
+
+		# The indexes agree with the tables
+		for version, codename in db.version_to_codename.items():
+			self.assertEqual(db.codename_to_version[codename], version)
+			self.assertEqual(db.lookup_codename(version + '.1'), codename)
+			self.assertEqual(db.lookup_codename(version + '.1'),
+					 lr.lookup_codename(version + '.1', db.version_to_codename))
+		self.assertEqual(db.lookup_codename('inexistent_release', 'n/a'), 'n/a')
+		# Arbitrary release strings do not grow the memo without bound
+		for i in range(lr.CODENAME_MEMO_SIZE * 2):
+			db.lookup_codename('inexistent_release%d' % i)
+		self.assertLessEqual(len(db._codenames), lr.CODENAME_MEMO_SIZE)
+		for suite in db.releases_order:
+			x = (500, {'suite': suite})
+			self.assertEqual(db.release_index(x), lr.release_index(x, db.releases_order))
+		self.assertEqual(db.release_index((500, {'suite': '2.5'})), 2.5)
+		self.assertEqual(db.release_index((500, {'suite': rnd_string(1,9)})), 0)
+		self.assertEqual(db.release_index((500, {})), 0)
+
+	@unittest.skipUnless(hasattr(sys, 'addaudithook'), 'needs audit hooks')
+	def test_import_without_file_io(self):
+		import subprocess
+		probe = ("import sys\n"
+			 "def hook(event, args):\n"
+			 "	if event == 'open' and 'distro-info' in str(args[0]):\n"
+			 "		print(args[0])\n"
+			 "sys.addaudithook(hook)\n"
+			 "import lsb_release\n")
+		env = os.environ.copy()
+		env['PYTHONPATH'] = os.path.dirname(os.path.abspath(lr.__file__))
+		output = subprocess.check_output([sys.executable, '-c', probe], env=env)
+		self.assertEqual(output, b'')
+
 	def test_get_distro_information(self):
 		# Test that an inexistant /usr/lib/os-release leads to empty output
 		supposed_output = get_arch_distinfo()
@@ -449,5 +643,103 @@ class TestLSBRelease(unittest.TestCase):
 		os.environ.pop('LSB_ETC_DPKG_ORIGINS_DEFAULT')
 		os.environ.pop('LSB_ETC_DEBIAN_VERSION')
 
+	def test_stage_timing(self):
+		import io, json
+		output = io.StringIO()
+		os.environ['LSB_OS_RELEASE'] = 'test/os-release'
+		lr.reset_timings()
+		lr.enable_timing(output)
+		try:
+			distinfo = lr.get_distro_information()
+		finally:
+			lr.disable_timing()
+			os.environ.pop('LSB_OS_RELEASE')
+		self.assertEqual(distinfo['ID'], '(Distributor Id)')
+		timings = lr.get_timings()
+		# Stages are recorded as they end, nested ones first
+		self.assertEqual(timings[0]['stage'], 'os_release')
+		self.assertEqual(timings[0]['parent'], 'get_distro_information')
+		self.assertEqual(timings[-1]['stage'], 'get_distro_information')
+		self.assertIsNone(timings[-1]['parent'])
+		for t in timings[:-1]:
+			self.assertIsNotNone(t['parent'])
+			self.assertTrue(timings[-1]['seconds'] >= t['seconds'] >= 0)
+		if 'opens' in timings[0]:
+			self.assertEqual(timings[0]['opens'], 1)
+		if 'read_bytes' in timings[0]:
+			self.assertEqual(timings[0]['read_bytes'],
+					 os.path.getsize('test/os-release'))
+		self.assertEqual([json.loads(line) for line in output.getvalue().splitlines()],
+				 timings)
+
+		# Nothing is recorded unless enabled
+		lr.reset_timings()
+		lr.get_os_release()
+		self.assertEqual(lr.get_timings(), [])
+
+	def test_stage_timing_from_environ(self):
+		import json
+		fn = 'test/timing_' + rnd_string(5,12)
+		cachefile = 'test/lsb_release_cache_' + rnd_string(5,12)
+		os.environ['LSB_OS_RELEASE'] = 'test/os-release'
+		os.environ['LSB_DEBUG_TIMING'] = fn
+		lr.reset_timings()
+		# LSB_DEBUG_TIMING is read when the first stage runs
+		lr.stage_timer.environ_checked = False
+		try:
+			lr.get_cached_distro_information(cachefile)
+			# A warm cache is not used while timing
+			lr.get_cached_distro_information(cachefile)
+		finally:
+			lr.disable_timing()
+			os.environ.pop('LSB_DEBUG_TIMING')
+			os.environ.pop('LSB_OS_RELEASE')
+		with open(fn) as f:
+			stages = [json.loads(line)['stage'] for line in f]
+		os.remove(fn)
+		self.assertFalse(os.path.exists(cachefile))
+		self.assertEqual(stages.count('get_distro_information'), 2)
+		self.assertEqual(stages[-1], 'cache')
+
+	def test_get_cached_distro_information(self):
+		os_release = 'test/os-release_' + rnd_string(5,12)
+		with open('test/os-release') as src, open(os_release,'w') as f:
+			f.write(src.read())
+		os.environ['LSB_OS_RELEASE'] = os_release
+		cachefile = 'test/lsb_release_cache_' + rnd_string(5,12)
+
+		# A cold call computes and stores the information
+		supposed_output = lr.get_distro_information()
+		self.assertEqual(lr.get_cached_distro_information(cachefile),supposed_output)
+		self.assertTrue(os.path.exists(cachefile))
+		self.assertEqual(os.stat(cachefile).st_mode & 0o777, 0o644)
+		self.assertEqual(lr.load_cached_distro_information(cachefile),supposed_output)
+
+		# A warm call is served from the cache
+		self.assertEqual(lr.get_cached_distro_information(cachefile),supposed_output)
+
+		# Changing one of the inputs invalidates the cache
+		f = open(os_release,'a')
+		f.write('VERSION_CODENAME=c0d3n4m3\n')
+		f.close()
+		self.assertEqual(lr.load_cached_distro_information(cachefile),None)
+		supposed_output = lr.get_distro_information()
+		self.assertEqual(supposed_output['CODENAME'],'c0d3n4m3')
+		self.assertEqual(lr.get_cached_distro_information(cachefile),supposed_output)
+
+		# So does pointing the LSB_* environment somewhere else
+		os.environ['LSB_OS_RELEASE'] = 'test/os-release'
+		self.assertEqual(lr.load_cached_distro_information(cachefile),None)
+
+		# A corrupted cache is ignored
+		f = open(cachefile,'w')
+		f.write(rnd_string(5,12))
+		f.close()
+		self.assertEqual(lr.load_cached_distro_information(cachefile),None)
+
+		os.remove(cachefile)
+		os.remove(os_release)
+		os.environ.pop('LSB_OS_RELEASE')
+
 if __name__ == '__main__':
 	unittest.main()
@@ -0,0 +1,66 @@
+#!/usr/bin/python3
+import unittest
+
+import lsbrunner
+
+class TestLsbRunner(unittest.TestCase):
+
+	def test_coalesce(self):
+		remove = ['update-inetd', '--group', 'LSB', '--remove']
+		add = ['update-inetd', '--group', 'LSB', '--add', 'foo\ttcp']
+		commands = [
+			['/usr/sbin/update-rc.d', 'foo', 'defaults'],
+			['/usr/sbin/update-rc.d', 'foo', 'defaults'],
+			remove + ['foo'],
+			remove + ['bar'],
+			remove + ['foo'],
+			add,
+			remove + ['baz'],
+		]
+		self.assertEqual(lsbrunner.coalesce(commands), [
+			['/usr/sbin/update-rc.d', 'foo', 'defaults'],
+			remove + ['(?:foo|bar)'],
+			add,
+			remove + ['baz'],
+		])
+
+	def test_coalesce_interleaved(self):
+		# Repeats apart from each other are kept, or the final state
+		# would be that of the command in between
+		remove = ['update-inetd', '--group', 'LSB', '--remove', 'foo']
+		add = ['update-inetd', '--group', 'LSB', '--add', 'foo\ttcp']
+		self.assertEqual(lsbrunner.coalesce([add, remove, add]), [add, remove, add])
+		commands = [
+			['/usr/sbin/update-rc.d', '-f', 'foo', 'remove'],
+			['/usr/sbin/update-rc.d', 'foo', 'start', '20', '2', '.'],
+			['/usr/sbin/update-rc.d', '-f', 'foo', 'remove'],
+		]
+		self.assertEqual(lsbrunner.coalesce(commands), commands)
+
+	def test_runner(self):
+		runner = lsbrunner.Runner(verbose=False)
+		runner.add(['true'])
+		runner.add(['true'])
+		runner.add(['false'])
+		self.assertEqual(runner.run(), 1)
+		# The second true repeated the first, so only ran once
+		self.assertEqual([(args, status) for (args, status, seconds) in runner.timings],
+				 [(['true'], 0), (['false'], 1)])
+		self.assertTrue(all(seconds >= 0 for (args, status, seconds) in runner.timings))
+		self.assertEqual(runner.run(), 0)
+
+	def test_runner_missing_tool(self):
+		runner = lsbrunner.Runner(verbose=False)
+		runner.add(['test/inexistant_tool'])
+		self.assertEqual(runner.run(), 127)
+
+	def test_runner_jobs(self):
+		runner = lsbrunner.Runner(jobs=4, verbose=False)
+		for i in range(4):
+			runner.add(['sleep', '0.2'], group=i)
+		runner.add(['sh', '-c', 'exit 3'], group='fail')
+		self.assertEqual(runner.run(), 3)
+		self.assertEqual(len(runner.timings), 5)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,144 @@
+#!/usr/bin/python3
+import unittest
+
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+import procscan
+
+class TestProcScan(unittest.TestCase):
+
+	def setUp(self):
+		self.tmpdir = tempfile.mkdtemp()
+		self.proc = os.path.join(self.tmpdir, 'proc')
+		os.mkdir(self.proc)
+		self.add_process(1, '/sbin/init', ['/sbin/init'])
+		self.add_process(200, '/usr/sbin/cupsd', ['/usr/sbin/cupsd', '-l'])
+		self.add_process(300, '/usr/bin/perl', ['/usr/bin/perl', '/usr/sbin/mydaemon'], 'mydaemon')
+		self.add_process(301, '/usr/bin/perl', ['/usr/bin/perl', '/usr/sbin/mydaemon'], 'mydaemon')
+		self.add_process(400, '/usr/bin/vim', ['vim', 'cupsd'])
+		# A kernel thread
+		self.add_process(2, None, [], 'kthreadd')
+		procscan.PIDDIR = os.path.join(self.tmpdir, 'run')
+		os.mkdir(procscan.PIDDIR)
+
+	def tearDown(self):
+		procscan.PIDDIR = '/var/run'
+		shutil.rmtree(self.tmpdir)
+
+	def add_process(self, pid, exe, argv, comm=None):
+		path = os.path.join(self.proc, str(pid))
+		os.mkdir(path)
+		if exe:
+			os.symlink(exe, os.path.join(path, 'exe'))
+		with open(os.path.join(path, 'cmdline'), 'wb') as fh:
+			fh.write(b''.join(arg.encode('utf-8') + b'\0' for arg in argv))
+		with open(os.path.join(path, 'comm'), 'w') as fh:
+			fh.write((comm or os.path.basename(exe))[:15] + '\n')
+
+	def write_pidfile(self, name, content):
+		pidfile = os.path.join(self.tmpdir, 'run', name)
+		with open(pidfile, 'w') as fh:
+			fh.write(content)
+		return pidfile
+
+	def test_pidofprocs(self):
+		running = self.write_pidfile('running.pid', '200\n')
+		dead = self.write_pidfile('dead.pid', '999\n')
+		empty = self.write_pidfile('empty.pid', '')
+		self.write_pidfile('init.pid', '')
+		services = [
+			('/usr/sbin/cupsd', None),
+			('/usr/sbin/mydaemon', None),
+			('/usr/sbin/missing', None),
+			('cupsd', running),
+			('cupsd', dead),
+			('cupsd', os.path.join(self.tmpdir, 'run', 'missing.pid')),
+			('cupsd', empty),
+			# An empty default pid file leaves the status unknown
+			('/sbin/init', None),
+			('kthreadd', None),
+		]
+		self.assertEqual(procscan.pidofprocs(services, self.proc, omit=()), [
+			(procscan.RUNNING, [200]),
+			(procscan.RUNNING, [300, 301]),
+			(procscan.NOT_RUNNING, []),
+			(procscan.RUNNING, [200]),
+			(procscan.DEAD, []),
+			(procscan.NOT_RUNNING, []),
+			(procscan.NOT_RUNNING, []),
+			(procscan.UNKNOWN, []),
+			(procscan.NOT_RUNNING, []),
+		])
+		# The asking script is left out
+		self.assertEqual(procscan.pidofprocs([('mydaemon', None)], self.proc, omit=(300,)),
+				 [(procscan.RUNNING, [301])])
+
+	@unittest.skipIf(os.getuid() == 0, 'root can read any pid file')
+	def test_unreadable_pidfile(self):
+		pidfile = self.write_pidfile('secret.pid', '1\n')
+		os.chmod(pidfile, 0)
+		self.assertEqual(procscan.pidofprocs([('init', pidfile)], self.proc),
+				 [(procscan.UNKNOWN, [])])
+
+	def test_own_process(self):
+		pidfile = self.write_pidfile('self.pid', '%d\n' % os.getpid())
+		self.assertEqual(procscan.pidofprocs([('python3', pidfile)]),
+				 [(procscan.RUNNING, [os.getpid()])])
+
+	def spawn(self, name, command, ready=None):
+		child = subprocess.Popen(command)
+		self.addCleanup(child.wait)
+		self.addCleanup(child.kill)
+		pidfile = self.write_pidfile(name + '.pid', '%d\n' % child.pid)
+		# Until the exec is done, the child is still called python
+		while procscan.Process(child.pid).comm != name:
+			time.sleep(0.01)
+		# and some children have more setting up to do once it is
+		while ready and not os.path.exists(ready):
+			time.sleep(0.01)
+		return child, pidfile
+
+	def test_stopprocs(self):
+		for pidfds in (True, False):
+			sleeper, sleeper_pid = self.spawn('sleep', ['sleep', '60'])
+			# Ignores TERM, and so takes a KILL
+			ready = os.path.join(self.tmpdir, 'ready-%s' % pidfds)
+			stubborn, stubborn_pid = self.spawn('sh', ['sh', '-c', 'trap "" TERM; touch "$0"; while :; do sleep 1; done', ready],
+							    ready=ready)
+			wrong_name = self.write_pidfile('other.pid', '%d\n' % sleeper.pid)
+			start = time.monotonic()
+			statuses = procscan.stopprocs([('sleep', sleeper_pid), ('sh', stubborn_pid),
+						       ('other', wrong_name), ('missing', None)],
+						      timeout=2, pidfds=pidfds)
+			self.assertEqual(statuses, [procscan.STOPPED, procscan.STOPPED,
+						    procscan.NOTHING_RUNNING, procscan.NOTHING_RUNNING])
+			# One wait of the timeout for both, not one each
+			self.assertLess(time.monotonic() - start, 3.5)
+			self.assertEqual(sleeper.wait(), -15)
+			self.assertEqual(stubborn.wait(), -9)
+
+	def test_exit_watcher(self):
+		child = subprocess.Popen(['sleep', '0.2'])
+		watcher = procscan.ExitWatcher([child.pid], pidfds=False)
+		try:
+			start = time.monotonic()
+			self.assertEqual(watcher.wait(5), set())
+			self.assertLess(time.monotonic() - start, 2)
+		finally:
+			watcher.close()
+		child.wait()
+		self.assertEqual(procscan.ExitWatcher([child.pid]).wait(1), set())
+
+	def test_parse_args(self):
+		self.assertEqual(procscan.parse_args(['-p', '/run/a.pid', 'a', 'b', '-p/run/c.pid', 'c']),
+				 [('a', '/run/a.pid'), ('b', None), ('c', '/run/c.pid')])
+		for args in ([], ['-p'], ['a', '-p', '/run/b.pid']):
+			with self.assertRaises(ValueError):
+				procscan.parse_args(args)
+
+if __name__ == '__main__':
+	unittest.main()